@@ -0,0 +1,259 @@
+"""
+Load test for the API. Only uses the standard library.
+
+Seed a database first, then run every scenario against gunicorn (src/wsgi.py):
+
+    $ pipenv run flask seed-db --users 1000 --people 100000 --planets 10000 --vehicles 10000 --favorites-per-user 20
+    $ python bench/loadtest.py --start-server --concurrency 50 --duration 20 --output bench/results.json
+    $ python bench/loadtest.py --url http://localhost:3000 --baseline bench/baseline.json
+
+Each scenario hammers one endpoint for --duration seconds with --concurrency clients and
+reports throughput, p50/p95/p99 latency, errors and SQL queries per request (read from /metrics).
+With --baseline the results are compared and the exit code is 1 if anything regressed.
+"""
+import os
+import sys
+import json
+import time
+import random
+import secrets
+import argparse
+import threading
+import subprocess
+import http.client
+import urllib.parse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#nombre -> (endpoint de flask, funcion que arma el request a partir de los ids de prueba)
+SCENARIOS = {
+    'get_people': ('get_specific_people', lambda ids, rng: ('GET', '/get-people/%s' % rng.choice(ids['people']), None)),
+    'get_planet': ('get_specific_planet', lambda ids, rng: ('GET', '/get-planet/%s' % rng.choice(ids['planets']), None)),
+    'get_vehicle': ('get_specific_vehicle', lambda ids, rng: ('GET', '/get-vehicle/%s' % rng.choice(ids['vehicles']), None)),
+    'list_people': ('list_people', lambda ids, rng: ('GET', '/people?limit=20&after=%s' % rng.choice(ids['people']), None)),
+    'add_favorite': ('add_favorite_people', lambda ids, rng: ('POST', '/add-favorite/people', {"people_id": rng.choice(ids['people'])}, rng.choice(ids['tokens']))),
+    'favorites': ('list_favorites', lambda ids, rng: ('POST', '/favorites', {}, rng.choice(ids['tokens']))),
+    'user': ('handle_hello', lambda ids, rng: ('GET', '/user', None)),
+}
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+class Client:
+    def __init__(self, url):
+        parsed = urllib.parse.urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.connection = None
+
+    def request(self, method, path, body=None, token=None):
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        headers = {}
+        if token is not None:
+            headers['Authorization'] = 'Bearer ' + token
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            data = response.read()
+            return response.status, data
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            raise
+
+def discover_ids(url, pages=5):
+    #toma ids reales de las listas paginadas (/people?after=...)
+    client = Client(url)
+    ids = {}
+    for entity in ('people', 'planets', 'vehicles', 'users'):
+        ids[entity] = []
+        after = None
+        for _ in range(pages):
+            path = '/%s?limit=100' % entity + ('&after=%s' % after if after else '')
+            status, data = client.request('GET', path)
+            if status != 200:
+                raise SystemExit('GET %s returned %s, is the database seeded?' % (path, status))
+            page = json.loads(data)
+            ids[entity].extend(row['id'] for row in page['results'])
+            after = page['next']
+            if after is None:
+                break
+        if not ids[entity]:
+            raise SystemExit('No %s found, run `flask seed-db` first' % entity)
+    return ids
+
+def login_users(url, count, password):
+    #los endpoints de favoritos piden token: se loguean algunos usuarios de seed-db (password 'bench')
+    client = Client(url)
+    status, data = client.request('GET', '/users?limit=%s' % count)
+    tokens = []
+    for user in json.loads(data)['results']:
+        status, data = client.request('POST', '/login', {"email": user['email'], "password": password})
+        if status == 200:
+            tokens.append(json.loads(data)['token'])
+    if not tokens:
+        raise SystemExit('Could not log in any user, were they created with `flask seed-db`?')
+    return tokens
+
+def sql_queries(url):
+    #{endpoint: (suma, cantidad)} de http_request_sql_queries en /metrics
+    status, data = Client(url).request('GET', '/metrics')
+    totals = {}
+    for line in data.decode().splitlines():
+        if not line.startswith('http_request_sql_queries_'):
+            continue
+        name, value = line.rsplit(' ', 1)
+        endpoint = name.split('endpoint="', 1)[1].split('"', 1)[0]
+        current = totals.setdefault(endpoint, [0.0, 0.0])
+        if name.startswith('http_request_sql_queries_sum'):
+            current[0] += float(value)
+        elif name.startswith('http_request_sql_queries_count'):
+            current[1] += float(value)
+    return totals
+
+def run_scenario(url, name, ids, concurrency, duration, seed):
+    endpoint, make_request = SCENARIOS[name]
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(number):
+        rng = random.Random(seed + number)
+        client = Client(url)
+        mine = []
+        failed = 0
+        while time.monotonic() < deadline:
+            request = make_request(ids, rng)
+            start = time.perf_counter()
+            try:
+                status, data = client.request(*request)
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                continue
+            mine.append(time.perf_counter() - start)
+            if status >= 500:
+                failed += 1
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    before = sql_queries(url)
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    after = sql_queries(url)
+
+    queries = None
+    if endpoint in after:
+        total, count = after[endpoint]
+        previous_total, previous_count = before.get(endpoint, (0.0, 0.0))
+        if count > previous_count:
+            queries = round((total - previous_total) / (count - previous_count), 2)
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "throughput": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        "queries_per_request": queries
+    }
+
+def compare(results, baseline, tolerance):
+    #regresion: menos throughput o p95 mas alto que el baseline por mas de tolerance
+    regressions = []
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous is None:
+            continue
+        if previous['throughput'] and current['throughput'] < previous['throughput'] * (1 - tolerance):
+            regressions.append('%s: throughput %s -> %s req/s' % (name, previous['throughput'], current['throughput']))
+        if previous['p95_ms'] and current['p95_ms'] and current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append('%s: p95 %sms -> %sms' % (name, previous['p95_ms'], current['p95_ms']))
+        if previous.get('queries_per_request') is not None and current.get('queries_per_request') is not None \
+                and current['queries_per_request'] >= previous['queries_per_request'] + 0.5: #cache hits hacen variar el promedio
+            regressions.append('%s: queries/request %s -> %s' % (name, previous['queries_per_request'], current['queries_per_request']))
+    return regressions
+
+def start_server(port):
+    command = ['gunicorn', 'wsgi', '--chdir', './src/', '-c', 'src/gunicorn_config.py', '-b', '127.0.0.1:%s' % port]
+    env = dict(os.environ)
+    env.setdefault('RATE_LIMIT_ENABLED', '0') #todos los clientes del test vienen de la misma IP
+    env.setdefault('TOKEN_SECRET', secrets.token_urlsafe(32)) #solo vive lo que dura el test
+    server = subprocess.Popen(command, cwd=ROOT, env=env)
+    url = 'http://127.0.0.1:%s' % port
+    for _ in range(100):
+        try:
+            Client(url).request('GET', '/metrics')
+            return server, url
+        except (OSError, http.client.HTTPException):
+            time.sleep(0.1)
+    server.terminate()
+    raise SystemExit('gunicorn did not start')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:3000')
+    parser.add_argument('--start-server', action='store_true', help='Start gunicorn (src/wsgi.py) on --port for the run')
+    parser.add_argument('--port', type=int, default=3999)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=os.path.join(ROOT, 'bench', 'results.json'))
+    parser.add_argument('--baseline', help='Previous results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--logins', type=int, default=20, help='Users to log in for the favorites scenarios')
+    parser.add_argument('--password', default='bench', help='Password of the seeded users')
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if args.start_server:
+        server, url = start_server(args.port)
+    try:
+        ids = discover_ids(url)
+        ids['tokens'] = login_users(url, args.logins, args.password)
+        results = {
+            "url": url,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "worker_class": os.getenv('GUNICORN_WORKER_CLASS', 'sync'),
+            "scenarios": {}
+        }
+        for name in args.scenarios.split(','):
+            results['scenarios'][name] = run_scenario(url, name, ids, args.concurrency, args.duration, args.seed)
+            print('%-14s %s' % (name, json.dumps(results['scenarios'][name])))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+    print('results written to %s' % args.output)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
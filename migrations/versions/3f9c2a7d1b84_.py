@@ -0,0 +1,39 @@
+"""unique (user_id, target) indexes on favorite tables
+
+Revision ID: 3f9c2a7d1b84
+Revises: 96461e954bec
+Create Date: 2026-10-18 10:12:41.220417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9c2a7d1b84'
+down_revision = '96461e954bec'
+branch_labels = None
+depends_on = None
+
+
+FAVORITE_TABLES = [
+    ('favorite_people', 'people_id'),
+    ('favorite_planet', 'planet_id'),
+    ('favorite_vehicle', 'vehicle_id'),
+]
+
+
+def upgrade():
+    for table, column in FAVORITE_TABLES:
+        # the old read-before-write check could let duplicates in, keep the oldest row of each pair
+        op.execute(
+            'DELETE FROM {table} WHERE id NOT IN '
+            '(SELECT id FROM (SELECT MIN(id) AS id FROM {table} GROUP BY user_id, {column}) AS keep)'
+            .format(table=table, column=column)
+        )
+        op.create_index('ix_{}_user_id_{}'.format(table, column), table, ['user_id', column], unique=True)
+
+
+def downgrade():
+    for table, column in FAVORITE_TABLES:
+        op.drop_index('ix_{}_user_id_{}'.format(table, column), table_name=table)
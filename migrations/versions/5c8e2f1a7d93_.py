@@ -0,0 +1,38 @@
+"""favorites: index the favorited column for popularity counts, touch_favorites_of and deletes
+
+Revision ID: 5c8e2f1a7d93
+Revises: 767debacd610
+Create Date: 2026-10-18 11:52:10.318254
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c8e2f1a7d93'
+down_revision = '767debacd610'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('favorite_people', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_favorite_people_people_id'), ['people_id'], unique=False)
+
+    with op.batch_alter_table('favorite_planet', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_favorite_planet_planet_id'), ['planet_id'], unique=False)
+
+    with op.batch_alter_table('favorite_vehicle', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_favorite_vehicle_vehicle_id'), ['vehicle_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('favorite_vehicle', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_favorite_vehicle_vehicle_id'))
+
+    with op.batch_alter_table('favorite_planet', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_favorite_planet_planet_id'))
+
+    with op.batch_alter_table('favorite_people', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_favorite_people_people_id'))
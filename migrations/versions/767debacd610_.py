@@ -0,0 +1,60 @@
+"""list filters: (column, id) indexes so ?gender=...&after=... reads only the page
+
+Revision ID: 767debacd610
+Revises: b4e7c1d9a356
+Create Date: 2026-10-18 11:25:46.806410
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '767debacd610'
+down_revision = 'b4e7c1d9a356'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('people', schema=None) as batch_op:
+        batch_op.create_index('ix_people_birth_year_id', ['birth_year', 'id'], unique=False)
+        batch_op.create_index('ix_people_eye_color_id', ['eye_color', 'id'], unique=False)
+        batch_op.create_index('ix_people_gender_id', ['gender', 'id'], unique=False)
+        batch_op.create_index('ix_people_hair_color_id', ['hair_color', 'id'], unique=False)
+        batch_op.create_index('ix_people_skin_color_id', ['skin_color', 'id'], unique=False)
+
+    with op.batch_alter_table('planet', schema=None) as batch_op:
+        batch_op.create_index('ix_planet_climate_id', ['climate', 'id'], unique=False)
+        batch_op.create_index('ix_planet_surface_water_id', ['surface_water', 'id'], unique=False)
+        batch_op.create_index('ix_planet_terrain_id', ['terrain', 'id'], unique=False)
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index('ix_user_is_active_id', ['is_active', 'id'], unique=False)
+        batch_op.create_index('ix_user_name_id', ['name', 'id'], unique=False)
+
+    with op.batch_alter_table('vehicle', schema=None) as batch_op:
+        batch_op.create_index('ix_vehicle_manufacturer_id', ['manufacturer', 'id'], unique=False)
+        batch_op.create_index('ix_vehicle_model_id', ['model', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('vehicle', schema=None) as batch_op:
+        batch_op.drop_index('ix_vehicle_model_id')
+        batch_op.drop_index('ix_vehicle_manufacturer_id')
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_name_id')
+        batch_op.drop_index('ix_user_is_active_id')
+
+    with op.batch_alter_table('planet', schema=None) as batch_op:
+        batch_op.drop_index('ix_planet_terrain_id')
+        batch_op.drop_index('ix_planet_surface_water_id')
+        batch_op.drop_index('ix_planet_climate_id')
+
+    with op.batch_alter_table('people', schema=None) as batch_op:
+        batch_op.drop_index('ix_people_skin_color_id')
+        batch_op.drop_index('ix_people_hair_color_id')
+        batch_op.drop_index('ix_people_gender_id')
+        batch_op.drop_index('ix_people_eye_color_id')
+        batch_op.drop_index('ix_people_birth_year_id')
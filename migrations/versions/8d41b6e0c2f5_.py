@@ -0,0 +1,37 @@
+"""version/updated_at columns for ETags and per-user favorites_version
+
+Revision ID: 8d41b6e0c2f5
+Revises: 3f9c2a7d1b84
+Create Date: 2026-10-18 11:02:17.503921
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d41b6e0c2f5'
+down_revision = '3f9c2a7d1b84'
+branch_labels = None
+depends_on = None
+
+
+VERSIONED_TABLES = ['user', 'people', 'planet', 'vehicle']
+
+
+def upgrade():
+    for table in VERSIONED_TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=False))
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('favorites_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('favorites_version')
+    for table in VERSIONED_TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('updated_at')
+            batch_op.drop_column('version')
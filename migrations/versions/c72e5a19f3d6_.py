@@ -0,0 +1,43 @@
+"""favorite_count popularity counters on people, planet and vehicle
+
+Revision ID: c72e5a19f3d6
+Revises: 8d41b6e0c2f5
+Create Date: 2026-10-18 11:41:05.318274
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c72e5a19f3d6'
+down_revision = '8d41b6e0c2f5'
+branch_labels = None
+depends_on = None
+
+
+COUNTED_TABLES = [
+    ('people', 'favorite_people', 'people_id'),
+    ('planet', 'favorite_planet', 'planet_id'),
+    ('vehicle', 'favorite_vehicle', 'vehicle_id'),
+]
+
+
+def upgrade():
+    for table, favorite_table, column in COUNTED_TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('favorite_count', sa.Integer(), server_default='0', nullable=False))
+            batch_op.create_index(batch_op.f('ix_{}_favorite_count'.format(table)), ['favorite_count'], unique=False)
+        # start from the real counts
+        op.execute(
+            'UPDATE {table} SET favorite_count = '
+            '(SELECT COUNT(*) FROM {favorite_table} WHERE {favorite_table}.{column} = {table}.id)'
+            .format(table=table, favorite_table=favorite_table, column=column)
+        )
+
+
+def downgrade():
+    for table, favorite_table, column in COUNTED_TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(batch_op.f('ix_{}_favorite_count'.format(table)))
+            batch_op.drop_column('favorite_count')
@@ -0,0 +1,32 @@
+"""favorites_snapshot: precomputed /favorites document per user
+
+Revision ID: e5b81f4c9a27
+Revises: c72e5a19f3d6
+Create Date: 2026-10-18 14:12:40.771203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b81f4c9a27'
+down_revision = 'c72e5a19f3d6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # snapshots are built on the first read, nothing to backfill
+    op.create_table('favorites_snapshot',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('document', sa.Text(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('favorites_snapshot')
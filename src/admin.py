@@ -1,22 +1,159 @@
 import os
 from flask_admin import Admin
-from models import db, User, People, Planet, Vehicle, FavoritePeople, FavoritePlanet, FavoriteVehicle
+from sqlalchemy import inspect
+from cache import invalidate_entity
+from models import db, User, People, Planet, Vehicle, FavoritePeople, FavoritePlanet, FavoriteVehicle, FAVORITE_KINDS, touch_user_favorites, touch_favorites_of, count_favorites, delete_favorites_of, delete_user_favorites, FavoritesSnapshot
 from flask_admin.contrib.sqla import ModelView
+from flask_admin.contrib.sqla.filters import FilterEqual, IntEqualFilter, IntGreaterFilter, IntSmallerFilter
+
+#exact = COUNT(*) en cada pagina, estimate = estimacion barata sin filtros, none = nunca cuenta (pager simple)
+ADMIN_COUNT = os.getenv('ADMIN_COUNT', 'estimate')
+ADMIN_PAGE_SIZE = int(os.getenv('ADMIN_PAGE_SIZE', 50))
+ADMIN_MAX_PAGE_SIZE = int(os.getenv('ADMIN_MAX_PAGE_SIZE', 200))
+#OFFSET grande recorre todas las filas salteadas; mas alla de esto hay que usar los filtros
+ADMIN_MAX_OFFSET = int(os.getenv('ADMIN_MAX_OFFSET', 10000))
+#las que tienen cache de entidades (ver cache.invalidate_entity)
+ENTITY_MODELS = (User, People, Planet, Vehicle)
+
+def touch_favorites_for(row):
+    #cambios hechos desde el admin tambien invalidan los snapshots/ETags de /favorites (misma transaccion)
+    catalog = [model for model, favorite_model, column in FAVORITE_KINDS.values()]
+    if isinstance(row, User):
+        if row.id is not None:
+            touch_user_favorites(row.id)
+    elif type(row) in catalog:
+        if row.id is not None: #uno nuevo todavia no es favorito de nadie
+            touch_favorites_of(type(row), row.id)
+    elif row.user is not None:
+        touch_user_favorites(row.user.id)
+
+def count_favorites_for(row, deleted=False):
+    #favorite_count (ver /popular) sigue a los favoritos creados, cambiados o borrados desde el admin
+    for kind, (model, favorite_model, column) in FAVORITE_KINDS.items():
+        if type(row) is not favorite_model:
+            continue
+        if deleted:
+            count_favorites(model, [getattr(row, column)], -1)
+            return
+        #el formulario cambia la relacion (row.people, row.planet...): antes y despues del cambio
+        history = inspect(row).attrs[kind].history
+        removed = [target.id for target in history.deleted if target is not None]
+        added = [target.id for target in history.added if target is not None]
+        if removed:
+            count_favorites(model, removed, -1)
+        if added:
+            count_favorites(model, added, 1)
+
+def delete_favorites_for(row):
+    #como los DELETE de la API: sin esto la FK NOT NULL de los favoritos hace fallar el borrado
+    if isinstance(row, User):
+        delete_user_favorites(row.id)
+        FavoritesSnapshot.query.filter_by(user_id=row.id).delete()
+    elif type(row) in ENTITY_MODELS:
+        delete_favorites_of(type(row), row.id)
+
+class FastModelView(ModelView):
+    #listados para tablas grandes: paginas acotadas, orden por la primary key y sin COUNT(*) por defecto
+    #column_sortable_list y column_filters de cada vista solo usan columnas con indice
+    page_size = ADMIN_PAGE_SIZE
+    can_set_page_size = True
+    column_default_sort = ('id', True)
+    simple_list_pager = ADMIN_COUNT == 'none'
+
+    def on_model_change(self, form, model, is_created):
+        touch_favorites_for(model)
+        count_favorites_for(model)
+
+    def on_model_delete(self, model):
+        touch_favorites_for(model)
+        count_favorites_for(model, deleted=True)
+        delete_favorites_for(model)
+
+    #despues del commit: la cache de entidades y /search no pueden seguir mostrando la fila vieja
+    def after_model_change(self, form, model, is_created):
+        if type(model) in ENTITY_MODELS:
+            invalidate_entity(type(model), model.id)
+
+    def after_model_delete(self, model):
+        if type(model) in ENTITY_MODELS:
+            invalidate_entity(type(model), model.id)
+
+    def get_count_query(self):
+        if ADMIN_COUNT != 'exact':
+            return None
+        return super().get_count_query()
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        page_size = min(page_size or self.page_size, ADMIN_MAX_PAGE_SIZE)
+        if page:
+            page = min(page, ADMIN_MAX_OFFSET // page_size)
+        count, query = super().get_list(page, sort_column, sort_desc, search, filters, execute=execute, page_size=page_size)
+        if ADMIN_COUNT == 'estimate' and not search and not filters:
+            count = self.estimate_count()
+        return count, query
+
+    def estimate_count(self):
+        #postgres: estimacion del planner (se actualiza con ANALYZE/autovacuum); si no, el mayor id
+        table = self.model.__table__
+        if self.session.get_bind().dialect.name == 'postgresql':
+            estimate = self.session.execute(
+                db.text('SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:table AS regclass)'),
+                {"table": table.name}).scalar()
+            if estimate and estimate > 0:
+                return estimate
+        return self.session.query(db.func.max(table.c.id)).scalar() or 0
+
+class UserView(FastModelView):
+    column_list = ('id', 'email', 'name', 'is_active', 'updated_at')
+    column_sortable_list = ('id', 'email')
+    column_filters = (IntEqualFilter(User.id, 'Id'), FilterEqual(User.email, 'Email'))
+    form_excluded_columns = ('favorite_people', 'favorite_planet', 'favorite_vehicle', 'version', 'updated_at', 'favorites_version')
+
+class CatalogView(FastModelView):
+    #People, Planet y Vehicle: id y name son unicos, favorite_count tiene indice
+    column_sortable_list = ('id', 'name', 'favorite_count')
+    column_exclude_list = ('version',)
+    form_excluded_columns = ('favorite_people', 'favorite_planet', 'favorite_vehicle', 'version', 'updated_at', 'favorite_count')
+
+    def __init__(self, model, session, **kwargs):
+        self.column_filters = (
+            IntEqualFilter(model.id, 'Id'),
+            FilterEqual(model.name, 'Name'),
+            IntGreaterFilter(model.favorite_count, 'Favorite count'),
+            IntSmallerFilter(model.favorite_count, 'Favorite count')
+        )
+        super().__init__(model, session, **kwargs)
+
+class FavoriteView(FastModelView):
+    #usuario y personaje/planeta/vehiculo con joinedload en la misma query del listado
+    #el formulario los busca por ajax en vez de cargar todas las filas en un select
+    def __init__(self, model, session, target, **kwargs):
+        self.column_list = ('id', 'user_id', 'user.name', target + '_id', target + '.name')
+        self.column_labels = {'user.name': 'User', target + '.name': target.capitalize()}
+        self.column_sortable_list = ('id',)
+        #el indice unico (user_id, <target>_id) sirve para filtrar por user_id
+        self.column_filters = (IntEqualFilter(model.id, 'Id'), IntEqualFilter(model.user_id, 'User id'))
+        self.column_select_related_list = ('user', target)
+        self.form_ajax_refs = {
+            'user': {'fields': ['email'], 'page_size': 10},
+            target: {'fields': ['name'], 'page_size': 10}
+        }
+        super().__init__(model, session, **kwargs)
 
 def setup_admin(app):
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
     admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
 
-    
+
     # Add your models here, for example this is how we add a the User model to the admin
-    admin.add_view(ModelView(User, db.session))
-    admin.add_view(ModelView(People, db.session))
-    admin.add_view(ModelView(Planet, db.session))
-    admin.add_view(ModelView(Vehicle, db.session))
-    admin.add_view(ModelView(FavoritePeople, db.session))
-    admin.add_view(ModelView(FavoritePlanet, db.session))
-    admin.add_view(ModelView(FavoriteVehicle, db.session))
+    admin.add_view(UserView(User, db.session))
+    admin.add_view(CatalogView(People, db.session))
+    admin.add_view(CatalogView(Planet, db.session))
+    admin.add_view(CatalogView(Vehicle, db.session))
+    admin.add_view(FavoriteView(FavoritePeople, db.session, 'people'))
+    admin.add_view(FavoriteView(FavoritePlanet, db.session, 'planet'))
+    admin.add_view(FavoriteView(FavoriteVehicle, db.session, 'vehicle'))
 
     # You can duplicate that line to add mew models
-    # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
+    # admin.add_view(YourView(YourModelName, db.session))
@@ -1,18 +1,44 @@
 """
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
+import io
 import os
-from flask import Flask, request, jsonify, url_for
+import time
+from datetime import datetime, timedelta
+from flask import Flask, request, jsonify, url_for, Response, stream_with_context
+from werkzeug.http import http_date
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_migrate import Migrate
 from flask_swagger import swagger
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
+from sqlalchemy import or_, and_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from utils import APIException, generate_sitemap, keyset_page, ndjson_chunks, csv_chunks, parse_fields, project
 from admin import setup_admin
-from models import db, User, People, Planet, Vehicle, FavoritePeople, FavoritePlanet, FavoriteVehicle
+from cache import cache_from_env, setup_entity_cache, entity_key, invalidate_entity
+from pool import engine_options_from_env, pool_stats
+from metrics import setup_metrics
+from json_provider import setup_json
+from commands import setup_commands
+from importer import IMPORT_ENTITIES, read_records, import_records
+from search import SearchIndex, SEARCH_FIELDS
+from replicas import setup_replicas, watch_replica_health, read_only, reading_replica, router
+from popularity import board_from_env
+from passwords import hash_password, verify_password, HashingBusy
+from tokens import auth_from_env
+from ratelimit import setup_rate_limits
+from compression import setup_compression
+from models import db, User, People, Planet, Vehicle, FavoritePeople, FavoritePlanet, FavoriteVehicle, FAVORITE_KINDS, load_user_favorites, load_favorites_snapshot, save_favorites_snapshot, FavoritesSnapshot, favorites_union, touch_user_favorites, touch_favorites_of, count_favorites, delete_favorites_of, delete_user_favorites, ChangeLog, record_change, record_changes
 #from models import Person
 
 app = Flask(__name__)
 app.url_map.strict_slashes = False
+#detras de un proxy (Render, nginx) remote_addr es la IP del proxy: se toma la del cliente de X-Forwarded-For,
+#confiando solo en los ultimos PROXY_FIX_X_FOR saltos (el resto del header lo puede inventar el cliente)
+proxy_hops = int(os.getenv('PROXY_FIX_X_FOR', 0))
+if proxy_hops:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxy_hops, x_proto=proxy_hops)
 
 db_url = os.getenv("DATABASE_URL")
 if db_url is not None:
@@ -20,16 +46,159 @@ if db_url is not None:
 else:
     app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options_from_env(app.config['SQLALCHEMY_DATABASE_URI'])
+
+setup_replicas(app)
 
 MIGRATE = Migrate(app, db)
 db.init_app(app)
+with app.app_context():
+    watch_replica_health(db)
 CORS(app)
 setup_admin(app)
+setup_json(app)
+setup_compression(app)
+setup_commands(app)
+entity_cache = cache_from_env()
+search_index = SearchIndex()
+setup_entity_cache(app, entity_cache, on_invalidate=search_index.refresh)
+popularity_board = board_from_env()
+token_auth = auth_from_env(app.logger)
 
 # Handle/serialize errors like a JSON object
 @app.errorhandler(APIException)
 def handle_invalid_usage(error):
-    return jsonify(error.to_dict()), error.status_code
+    return jsonify(error.to_dict()), error.status_code, error.headers or {}
+
+#version_id_col: otro request (o un import) cambio la fila entre que se leyo y se guardo.
+#Pasa en los PUT/DELETE de User/People/Planet/Vehicle; no se pisa el cambio ajeno, el cliente vuelve a leer
+@app.errorhandler(StaleDataError)
+def handle_stale_data(error):
+    db.session.rollback()
+    return handle_invalid_usage(APIException('The resource was changed by another request, read it again and retry', status_code=409))
+
+#cache de lectura para User/People/Planet/Vehicle serializados
+#cada entrada guarda el json y la version/fecha para armar ETag y Last-Modified
+def entity_etag(model, id, version):
+    return '%s-%s-v%s' % (model.__tablename__, id, version)
+
+def cached_entity_entry(key):
+    #None si no esta o si es la marca que deja invalidate_entity
+    entry = entity_cache.get(key)
+    return entry if entry is not None and "data" in entry else None
+
+def cache_entity_entry(key, entry):
+    #una replica atrasada puede devolver la fila de antes de un PUT/DELETE reciente:
+    #mientras dure la marca de invalidate_entity solo se llena la cache con lecturas del primario
+    if reading_replica():
+        mark = entity_cache.get(key)
+        if mark is not None and "data" not in mark and mark["stale_until"] > time.time():
+            return
+    entity_cache.set(key, entry)
+
+def get_entity_entry(model, id):
+    key = entity_key(model, id)
+    entry = cached_entity_entry(key)
+    if entry is None:
+        row = model.query.get(id)
+        if row is None:
+            raise APIException('%s not found' % model.__name__, status_code=404)
+        entry = make_entity_entry(model, row)
+        cache_entity_entry(key, entry)
+    return entry
+
+def make_entity_entry(model, row):
+    return {
+        "data": row.serialize(),
+        "etag": entity_etag(model, row.id, row.version),
+        "last_modified": http_date(row.updated_at)
+    }
+
+def get_entity_entries(model, ids):
+    #varios ids: lo que no esta en cache se trae con un solo IN; devuelve {id: entry} sin los que no existen
+    entries = {}
+    for id in ids:
+        entry = cached_entity_entry(entity_key(model, id))
+        if entry is not None:
+            entries[id] = entry
+    misses = [id for id in ids if id not in entries]
+    if misses:
+        for row in model.query.filter(model.id.in_(misses)):
+            entries[row.id] = make_entity_entry(model, row)
+            cache_entity_entry(entity_key(model, row.id), entries[row.id])
+    return entries
+
+def get_serialized(model, id):
+    return get_entity_entry(model, id)["data"]
+
+def requested_fields(model):
+    #?fields=id,name -> solo esas columnas (en el orden de serialize_columns); None = todas
+    fields = parse_fields(request.args.get('fields'))
+    if fields is None:
+        return None
+    unknown = [field for field in fields if field not in model.serialize_columns or fields[field] is not None]
+    if unknown:
+        raise APIException('Unknown fields: %s (available: %s)' % (', '.join(unknown), ', '.join(model.serialize_columns)), status_code=400)
+    return tuple(column for column in model.serialize_columns if column in fields)
+
+def pick_fields(data, fields):
+    if fields is None:
+        return data
+    return {field: data[field] for field in fields}
+
+def entity_response(model, id):
+    fields = requested_fields(model)
+    #GET con If-None-Match: si no esta en cache, primero se compara solo la version (sin traer la fila)
+    if request.if_none_match and cached_entity_entry(entity_key(model, id)) is None:
+        version = db.session.query(model.version).filter(model.id == id).scalar()
+        if version is None:
+            raise APIException('%s not found' % model.__name__, status_code=404)
+        etag = entity_etag(model, id, version)
+        if request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+
+    entry = get_entity_entry(model, id)
+    response = jsonify(pick_fields(entry["data"], fields))
+    response.set_etag(entry["etag"])
+    response.headers['Last-Modified'] = entry["last_modified"]
+    return response.make_conditional(request)
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(entity_cache.stats()), 200
+
+@app.route('/metrics/pool', methods=['GET'])
+def database_pool_stats():
+    return jsonify(pool_stats(db.engine)), 200
+
+@app.route('/metrics/replicas', methods=['GET'])
+def replica_stats():
+    return jsonify(router.stats()), 200
+
+def pool_metric_lines():
+    lines = []
+    for name, value in pool_stats(db.engine).items():
+        if isinstance(value, (int, float)) and name != 'pid':
+            lines.append('db_pool_%s %s' % (name, value))
+    return lines
+
+setup_metrics(app, extra_lines=pool_metric_lines)
+
+def rate_limit_key():
+    #con token valido se cuenta por usuario, si no por IP
+    if request.headers.get('Authorization'):
+        try:
+            return 'user:%s' % token_auth.current_user_id()
+        except APIException:
+            pass
+    return 'ip:%s' % request.remote_addr
+
+#por defecto no se admiten mas requests simultaneos que conexiones tiene el pool
+engine_options = app.config['SQLALCHEMY_ENGINE_OPTIONS']
+rate_limiter = setup_rate_limits(app, rate_limit_key,
+    default_max_concurrent=engine_options.get('pool_size', 0) + engine_options.get('max_overflow', 0))
 
 # generate sitemap with all your endpoints
 @app.route('/')
@@ -37,25 +206,23 @@ def sitemap():
     return generate_sitemap(app)
 
 @app.route('/user', methods=['GET'])
+@read_only
 def handle_hello():
-    users = User.query.all()
-    users = list((map(lambda item: item.serialize(), users)))
-    print(users)
-    response_body = {
-        "msg": "Hello, this is your GET /user response "
-    }
+    columns = User.serialize_columns
+    users = [dict(zip(columns, row)) for row in db.session.query(*[getattr(User, column) for column in columns])]
 
     return jsonify(users), 200
 
+def hash_or_busy(password):
+    try:
+        return hash_password(password)
+    except HashingBusy:
+        raise APIException('Server busy, try again', status_code=503, headers={'Retry-After': '1'})
+
 @app.route('/register', methods=['POST'])
 def register_user():
     #recibir body en json y almacenarl en la variable body
     body = request.get_json() #request.json() pero hay q importar request y json
-    #ordernar campos recibidos
-    email = body['email']
-    name = body['name']
-    password = body['password']
-    is_active = body['is_active']
     
     #validaciones
     if body is None: #ejecuto una excepcion de la API
@@ -69,6 +236,14 @@ def register_user():
         raise APIException('You need to specify the password', status_code=400)
     if 'is_active' not in body:
         raise APIException('You need to specify if user is active or not', status_code=400)
+    if not all(isinstance(body[field], str) for field in ('email', 'name', 'password')):
+        raise APIException('email, name and password must be strings', status_code=400)
+
+    #ordernar campos recibidos
+    email = body['email']
+    name = body['name']
+    password = hash_or_busy(body['password'])
+    is_active = body['is_active']
     
     #estructura para almacenar datos de usuarios nuevos
     #creada clase User en la variable new_user
@@ -76,24 +251,60 @@ def register_user():
     
     #comitear la sesión
     db.session.add(new_user)
+    db.session.flush() #para tener el id en el change_log
+    record_change(User, new_user.id, 'created', new_user.serialize())
     db.session.commit()
     
     return jsonify({"mensaje": "Usuario creado correctamente"}), 201
 
+@app.route('/login', methods=['POST'])
+def login():
+    body = request.get_json()
+    if body is None or 'email' not in body or 'password' not in body:
+        raise APIException('You need to specify the email and password', status_code=400)
+    if not isinstance(body['email'], str) or not isinstance(body['password'], str):
+        raise APIException('email and password must be strings', status_code=400)
+
+    user = User.query.filter_by(email=body['email']).first()
+    if user is None:
+        raise APIException('Invalid email or password', status_code=401)
+    try:
+        matches, needs_rehash = verify_password(user.password, body['password'])
+    except HashingBusy:
+        raise APIException('Too many logins right now, try again', status_code=503, headers={'Retry-After': '1'})
+    if not matches:
+        raise APIException('Invalid email or password', status_code=401)
+    if not user.is_active:
+        raise APIException('User is not active', status_code=403)
+
+    if needs_rehash:
+        #cambiaron los parametros de scrypt (o era texto plano): se guarda el hash nuevo
+        user.password = hash_or_busy(body['password'])
+        db.session.commit()
+        invalidate_entity(User, user.id) #el UPDATE subio la version: el ETag en cache quedo viejo
+
+    #el token se manda en Authorization: Bearer <token> a los endpoints de favoritos
+    return jsonify({"token": token_auth.issue(user), "expires_in": token_auth.max_age, "user": user.serialize()}), 200
+
+def authorized_user_id(body):
+    #el usuario sale del token, sin consultar la base; si el body trae user_id tiene que coincidir
+    user_id = token_auth.current_user_id()
+    if body is not None and body.get('user_id') is not None and str(body['user_id']) != str(user_id):
+        raise APIException('user_id does not match the token', status_code=403)
+    return user_id
+
 @app.route('/get-user/<int:id>', methods=['GET'])
+@read_only
 def get_specific_user(id):
-    user = User.query.get(id)
-    
-    return jsonify(user.serialize()), 200
+    return entity_response(User, id)
 
 @app.route('/get-user', methods=['POST'])
+@read_only
 def get_specific_user2():
     body = request.get_json()
     id = body['id']
-    
-    user = User.query.get(id)
 
-    return jsonify(user.serialize()), 200 
+    return jsonify(pick_fields(get_serialized(User, id), requested_fields(User))), 200 
 
 @app.route('/get-user', methods=['DELETE'])
 def delete_specific_user():
@@ -101,9 +312,15 @@ def delete_specific_user():
     id = body['id']
     
     user = User.query.get(id)
+    if user is None:
+        raise APIException('User not found', status_code=404)
 
+    delete_user_favorites(id)
+    FavoritesSnapshot.query.filter_by(user_id=id).delete()
     db.session.delete(user)
-    db.session.commit
+    record_change(User, id, 'deleted')
+    db.session.commit()
+    invalidate_entity(User, id)
 
     return jsonify("Usuario borrado"), 200 
 
@@ -115,27 +332,203 @@ def edit_user():
 
     user = User.query.get(id)
     user.name = name
+    touch_user_favorites(id) #el nombre del usuario aparece en sus favoritos
+    record_change(User, id, 'updated', user.serialize())
     
     db.session.commit()
+    invalidate_entity(User, id)
 
     return jsonify(user.serialize()), 200 
 
+#APIS DE LISTADOS --------------------------------------------
+#columnas por las que se puede filtrar cada listado: ?gender=male&after=20&limit=50
+#cada una tiene su indice (columna, id) en models.py (filter_indexes); una columna nueva necesita el suyo
+LIST_FILTERS = {
+    User: ['email', 'name', 'is_active'],
+    People: ['gender', 'eye_color', 'hair_color', 'skin_color', 'birth_year'],
+    Planet: ['climate', 'terrain', 'surface_water'],
+    Vehicle: ['manufacturer', 'model']
+}
+
+BATCH_MAX_IDS = 300
+
+def batch_entities(model):
+    #?ids=3,1,2 -> mismos objetos que /get-<entity>/<id>, en el orden pedido
+    try:
+        ids = [int(id) for id in request.args['ids'].split(',') if id.strip()]
+    except ValueError:
+        raise APIException('ids must be a comma separated list of integers', status_code=400)
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > BATCH_MAX_IDS:
+        raise APIException('Too many ids, the limit is %s' % BATCH_MAX_IDS, status_code=400)
+    fields = requested_fields(model)
+
+    entries = get_entity_entries(model, ids)
+
+    return jsonify({
+        "results": [pick_fields(entries[id]["data"], fields) for id in ids if id in entries],
+        "missing": [id for id in ids if id not in entries]
+    }), 200
+
+def list_entities(model):
+    if 'ids' in request.args:
+        return batch_entities(model)
+    #solo las columnas del json (o las de ?fields=): las filas llegan como tuplas y no se arman objetos del ORM
+    columns = requested_fields(model) or model.serialize_columns
+    selected = columns if 'id' in columns else ('id',) + columns #el cursor necesita el id
+    query = db.session.query(*[getattr(model, column) for column in selected])
+    for column in LIST_FILTERS[model]:
+        value = request.args.get(column)
+        if value is None:
+            continue
+        if column == 'is_active':
+            value = value.lower() in ('1', 'true', 'yes')
+        query = query.filter(getattr(model, column) == value)
+
+    after = request.args.get('after', type=int)
+    limit = request.args.get('limit', 20, type=int)
+    rows, next_cursor = keyset_page(query, model.id, after=after, limit=limit)
+
+    return jsonify({
+        "results": [{column: getattr(row, column) for column in columns} for row in rows],
+        "next": next_cursor
+    }), 200
+
+@app.route('/users', methods=['GET'])
+@read_only
+def list_users():
+    return list_entities(User)
+
+@app.route('/people', methods=['GET'])
+@read_only
+def list_people():
+    return list_entities(People)
+
+@app.route('/planets', methods=['GET'])
+@read_only
+def list_planets():
+    return list_entities(Planet)
+
+@app.route('/vehicles', methods=['GET'])
+@read_only
+def list_vehicles():
+    return list_entities(Vehicle)
+
+#APIS DE EXPORTACION --------------------------------------------
+EXPORT_ENTITIES = {
+    'users': User,
+    'people': People,
+    'planets': Planet,
+    'vehicles': Vehicle
+}
+EXPORT_BATCH_SIZE = 1000
+
+@app.route('/export/<entity>', methods=['GET'])
+@read_only
+def export_entity(entity):
+    #GET /export/people?format=csv  (por defecto ndjson)
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        raise APIException('Format must be ndjson or csv', status_code=400)
+
+    if entity == 'favorites':
+        #solo los favoritos del usuario del token
+        user_id = authorized_user_id(None)
+        favorite = favorites_union()
+        columns = ('id', 'user_id', 'kind', 'target_id')
+        #sin ORDER BY: ordenar el UNION obligaria a la base a juntar todas las filas antes de mandar la primera
+        query = db.session.query(*[favorite.c[column] for column in columns]).filter(favorite.c.user_id == user_id)
+    elif entity in EXPORT_ENTITIES:
+        model = EXPORT_ENTITIES[entity]
+        columns = model.serialize_columns
+        query = db.session.query(*[getattr(model, column) for column in columns]).order_by(model.id)
+    else:
+        raise APIException('Unknown entity: %s' % entity, status_code=404)
+
+    #yield_per usa un cursor del lado del servidor: la memoria no crece con el tamaño de la tabla
+    rows = query.yield_per(EXPORT_BATCH_SIZE)
+    if export_format == 'csv':
+        chunks, mimetype = csv_chunks(columns, rows, EXPORT_BATCH_SIZE), 'text/csv'
+    else:
+        chunks, mimetype = ndjson_chunks(columns, rows, EXPORT_BATCH_SIZE), 'application/x-ndjson'
+
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = 'attachment; filename=%s.%s' % (entity, export_format)
+    return response
+
+#APIS DE IMPORTACION --------------------------------------------
+@app.route('/import/<entity>', methods=['POST'])
+def import_entity(entity):
+    #el body es el archivo: Content-Type text/csv o application/x-ndjson (o ?format=csv)
+    if entity not in IMPORT_ENTITIES:
+        raise APIException('Unknown entity: %s' % entity, status_code=404)
+    import_format = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'ndjson')
+    if import_format not in ('ndjson', 'csv'):
+        raise APIException('Format must be ndjson or csv', status_code=400)
+
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8')
+    try:
+        report = import_records(IMPORT_ENTITIES[entity], read_records(stream, import_format))
+    except ValueError as error: #el archivo no es utf-8 (las lineas invalidas van al reporte)
+        db.session.rollback()
+        raise APIException('Invalid %s: %s' % (import_format, error), status_code=400)
+    finally:
+        #no sabemos que ids cambiaron; los chunks anteriores a un error ya quedaron guardados
+        entity_cache.clear()
+        search_index.reset()
+
+    return jsonify(report), 200
+
+#APIS DE BUSQUEDA --------------------------------------------
+@app.route('/search', methods=['GET'])
+@read_only
+def search():
+    #GET /search?q=sky&type=people,vehicle&limit=20&offset=0
+    text = request.args.get('q', '').strip()
+    if not text:
+        raise APIException('You need to specify the q parameter', status_code=400)
+    kinds = [kind for kind in request.args.get('type', '').split(',') if kind]
+    for kind in kinds:
+        if kind not in SEARCH_FIELDS:
+            raise APIException('Unknown type: %s' % kind, status_code=400)
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    offset = max(0, request.args.get('offset', 0, type=int))
+
+    total, results = search_index.search(text, kinds=kinds, limit=limit, offset=offset)
+
+    return jsonify({"total": total, "results": results}), 200
+
+#APIS DE POPULARES --------------------------------------------
+POPULAR_ENTITIES = {
+    'people': 'people',
+    'planets': 'planet',
+    'vehicles': 'vehicle'
+}
+
+@app.route('/popular/<entity>', methods=['GET'])
+@read_only
+def popular(entity):
+    #GET /popular/people?limit=10 -> los mas elegidos como favorito
+    if entity not in POPULAR_ENTITIES:
+        raise APIException('Unknown entity: %s' % entity, status_code=404)
+    limit = max(1, min(request.args.get('limit', 10, type=int), popularity_board.size))
+
+    return jsonify(popularity_board.top(POPULAR_ENTITIES[entity], limit)), 200
+
 #APIS DE PEOPLE --------------------------------------------
 
 @app.route('/get-people/<int:id>', methods=['GET'])
+@read_only
 def get_specific_people(id):
-    people = People.query.get(id)
-    
-    return jsonify(people.serialize()), 200
+    return entity_response(People, id)
 
 @app.route('/get-people', methods=['POST'])
+@read_only
 def get_specific_people2():
     body = request.get_json()
     id = body['id']
-    
-    people = People.query.get(id)
 
-    return jsonify(people.serialize()), 200 
+    return jsonify(pick_fields(get_serialized(People, id), requested_fields(People))), 200 
 
 @app.route('/get-people', methods=['DELETE'])
 def delete_specific_people():
@@ -143,9 +536,14 @@ def delete_specific_people():
     id = body['id']
     
     people = People.query.get(id)
+    if people is None:
+        raise APIException('People not found', status_code=404)
 
+    delete_favorites_of(People, id)
     db.session.delete(people)
-    db.session.commit
+    record_change(People, id, 'deleted')
+    db.session.commit()
+    invalidate_entity(People, id)
 
     return jsonify("Person successfully deleted!"), 200 
 
@@ -155,29 +553,30 @@ def edit_people():
     id = body['id']
     name = body["name"]
 
-    people = User.query.get(id)
+    people = People.query.get(id)
     people.name = name
+    touch_favorites_of(People, id)
+    record_change(People, id, 'updated', people.serialize())
     
     db.session.commit()
+    invalidate_entity(People, id)
 
     return jsonify(people.serialize()), 200 
 
 #APIS DE PLANET --------------------------------------------
 
 @app.route('/get-planet/<int:id>', methods=['GET'])
+@read_only
 def get_specific_planet(id):
-    planet = Planet.query.get(id)
-    
-    return jsonify(planet.serialize()), 200
+    return entity_response(Planet, id)
 
 @app.route('/get-planet', methods=['POST'])
+@read_only
 def get_specific_planet2():
     body = request.get_json()
     id = body['id']
-    
-    planet = Planet.query.get(id)
 
-    return jsonify(planet.serialize()), 200 
+    return jsonify(pick_fields(get_serialized(Planet, id), requested_fields(Planet))), 200 
 
 @app.route('/get-planet', methods=['DELETE'])
 def delete_specific_planet():
@@ -185,9 +584,14 @@ def delete_specific_planet():
     id = body['id']
     
     planet = Planet.query.get(id)
+    if planet is None:
+        raise APIException('Planet not found', status_code=404)
 
+    delete_favorites_of(Planet, id)
     db.session.delete(planet)
-    db.session.commit
+    record_change(Planet, id, 'deleted')
+    db.session.commit()
+    invalidate_entity(Planet, id)
 
     return jsonify("Planet successfully deleted!"), 200 
 
@@ -199,27 +603,28 @@ def edit_planet():
 
     planet = Planet.query.get(id)
     planet.name = name
+    touch_favorites_of(Planet, id)
+    record_change(Planet, id, 'updated', planet.serialize())
     
     db.session.commit()
+    invalidate_entity(Planet, id)
 
     return jsonify(planet.serialize()), 200 
 
 #APIS DE VEHICLE --------------------------------------------
 
 @app.route('/get-vehicle/<int:id>', methods=['GET'])
+@read_only
 def get_specific_vehicle(id):
-    vehicle = Vehicle.query.get(id)
-    
-    return jsonify(vehicle.serialize()), 200
+    return entity_response(Vehicle, id)
 
 @app.route('/get-vehicle', methods=['POST'])
+@read_only
 def get_specific_vehicle2():
     body = request.get_json()
     id = body['id']
-    
-    vehicle = Vehicle.query.get(id)
 
-    return jsonify(vehicle.serialize()), 200 
+    return jsonify(pick_fields(get_serialized(Vehicle, id), requested_fields(Vehicle))), 200 
 
 @app.route('/get-vehicle', methods=['DELETE'])
 def delete_specific_vehicle():
@@ -227,9 +632,14 @@ def delete_specific_vehicle():
     id = body['id']
     
     vehicle = Vehicle.query.get(id)
+    if vehicle is None:
+        raise APIException('Vehicle not found', status_code=404)
 
+    delete_favorites_of(Vehicle, id)
     db.session.delete(vehicle)
-    db.session.commit
+    record_change(Vehicle, id, 'deleted')
+    db.session.commit()
+    invalidate_entity(Vehicle, id)
 
     return jsonify("Vehicle successfully deleted!"), 200 
 
@@ -241,117 +651,309 @@ def edit_vehicle():
 
     vehicle = Vehicle.query.get(id)
     vehicle.name = name
+    touch_favorites_of(Vehicle, id)
+    record_change(Vehicle, id, 'updated', vehicle.serialize())
     
     db.session.commit()
+    invalidate_entity(Vehicle, id)
 
     return jsonify(vehicle.serialize()), 200 
 
+def favorite_conflict(user_id, message, status_code=404):
+    #el insert de un favorito fallo: el indice unico (ya era favorito) o la FK (el usuario del token ya no existe)
+    db.session.rollback()
+    if db.session.query(User.id).filter(User.id == user_id).scalar() is None:
+        raise APIException('User not found', status_code=404)
+    raise APIException(message, status_code=status_code)
+
 #APIS FAVORITE PEOPLE --------------------------------------------
 @app.route('/add-favorite/people', methods=['POST'])
 def add_favorite_people():
     body = request.get_json()
-    user_id = body['user_id']
+    user_id = authorized_user_id(body)
     people_id = body['people_id']
 
     character = People.query.get(people_id) #cuando encuentra el primero, detiene la busqueda => .first()
     if not character: #validacion de errores, obligatorio
         raise APIException('Not found', status_code=404)
-    
-    user = User.query.get(user_id)
-    if not user:
-        raise APIException('Favorite People Not Found', status_code=404)
+    character_data = character.serialize() #se serializa antes del commit, despues habria que volver a leerlo
 
-    favorite_exist = FavoritePeople.query.filter_by(user_id = user.id, people_id = character.id).first() is not None
-    
-    if favorite_exist:
-        raise APIException('Favorite people already exists in user account', status_code=404)
-
-    favorite_people = FavoritePeople(user_id = user.id, people_id = character.id)
+    #el indice unico (user_id, people_id) rechaza el duplicado, sin consultar antes
+    favorite_people = FavoritePeople(user_id = user_id, people_id = character.id)
     db.session.add(favorite_people)
-    db.session.commit()
-
-    return jsonify(favorite_people.serialize()), 201
+    touch_user_favorites(user_id)
+    count_favorites(People, [character.id], 1)
+    record_changes('favorite_people', 'created', [character.id], user_id=user_id)
+    try:
+        db.session.flush()
+        favorite_id = favorite_people.id
+        db.session.commit()
+    except IntegrityError:
+        favorite_conflict(user_id, 'Favorite people already exists in user account')
+
+    #el usuario sale de la cache de entidades
+    return jsonify(FavoritePeople.serialize_parts(favorite_id, get_serialized(User, user_id), character_data)), 201
 
 #APIS FAVORITES PLANET --------------------------------------------
 
 @app.route('/add-favorite/planet', methods=['POST'])
 def add_favorite_planet():
     body = request.get_json()
-    user_id = body['user_id']
+    user_id = authorized_user_id(body)
     planet_id = body['planet_id']
 
     planet = Planet.query.get(planet_id) #cuando encuentra el primero, detiene la busqueda => .first()
     if not planet: #validacion de errores, obligatorio
         raise APIException('Planet not found', status_code=404)
-    
-    user = User.query.get(user_id)
-    if not user:
-        raise APIException('User not found', status_code=404)
-
-    favorite_exist = FavoritePlanet.query.filter_by(user_id = user.id, planet_id = planet.id).first() is not None
-    
-    if favorite_exist:
-        raise APIException('Favorite planet already exists in user account', status_code=404)
+    planet_data = planet.serialize() #se serializa antes del commit, despues habria que volver a leerlo
 
-    favorite_planet = FavoritePlanet(user_id = user.id, planet_id = planet.id)
+    #el indice unico (user_id, planet_id) rechaza el duplicado, sin consultar antes
+    favorite_planet = FavoritePlanet(user_id = user_id, planet_id = planet.id)
     db.session.add(favorite_planet)
-    db.session.commit()
-
-    return jsonify(favorite_planet.serialize()), 201
+    touch_user_favorites(user_id)
+    count_favorites(Planet, [planet.id], 1)
+    record_changes('favorite_planet', 'created', [planet.id], user_id=user_id)
+    try:
+        db.session.flush()
+        favorite_id = favorite_planet.id
+        db.session.commit()
+    except IntegrityError:
+        favorite_conflict(user_id, 'Favorite planet already exists in user account')
+
+    #el usuario sale de la cache de entidades
+    return jsonify(FavoritePlanet.serialize_parts(favorite_id, get_serialized(User, user_id), planet_data)), 201
 
 #APIS FAVORITES VEHICLE --------------------------------------------
 
 @app.route('/add-favorite/vehicle', methods=['POST'])
 def add_favorite_vehicle():
     body = request.get_json()
-    user_id = body['user_id']
+    user_id = authorized_user_id(body)
     vehicle_id = body['vehicle_id']
 
     vehicle = Vehicle.query.get(vehicle_id) #cuando encuentra el primero, detiene la busqueda => .first()
     if not vehicle: #validacion de errores, obligatorio
         raise APIException('Vehicle not found', status_code=404)
-    
-    user = User.query.get(user_id)
-    if not user:
-        raise APIException('User not found', status_code=404)
-
-    favorite_exist = FavoriteVehicle.query.filter_by(user_id = user.id, vehicle_id = vehicle.id).first() is not None
-    
-    if favorite_exist:
-        raise APIException('Favorite vehicle already exists in user account', status_code=404)
+    vehicle_data = vehicle.serialize() #se serializa antes del commit, despues habria que volver a leerlo
 
-    favorite_vehicle = FavoriteVehicle(user_id = user.id, vehicle_id = vehicle.id)
+    #el indice unico (user_id, vehicle_id) rechaza el duplicado, sin consultar antes
+    favorite_vehicle = FavoriteVehicle(user_id = user_id, vehicle_id = vehicle.id)
     db.session.add(favorite_vehicle)
-    db.session.commit()
-
-    return jsonify(favorite_vehicle.serialize()), 201
+    touch_user_favorites(user_id)
+    count_favorites(Vehicle, [vehicle.id], 1)
+    record_changes('favorite_vehicle', 'created', [vehicle.id], user_id=user_id)
+    try:
+        db.session.flush()
+        favorite_id = favorite_vehicle.id
+        db.session.commit()
+    except IntegrityError:
+        favorite_conflict(user_id, 'Favorite vehicle already exists in user account')
+
+    #el usuario sale de la cache de entidades
+    return jsonify(FavoriteVehicle.serialize_parts(favorite_id, get_serialized(User, user_id), vehicle_data)), 201
+
+#APIS FAVORITES BULK --------------------------------------------
+BULK_FAVORITES_MAX_ITEMS = 500
+
+def bulk_favorite_ids(body, field):
+    #{"people": [1, 2], ...}: se valida la forma antes de consultar nada (un id no entero en Postgres es un DataError)
+    items = body.get(field) or {}
+    if not isinstance(items, dict):
+        raise APIException('"%s" must be an object like {"people": [1, 2]}' % field, status_code=400)
+    for kind, ids in items.items():
+        if kind not in FAVORITE_KINDS:
+            raise APIException('Unknown favorite type: %s' % kind, status_code=400)
+        if not isinstance(ids, list) or not all(isinstance(id, int) and not isinstance(id, bool) for id in ids):
+            raise APIException('"%s.%s" must be a list of integer ids' % (field, kind), status_code=400)
+    return items
+
+@app.route('/favorites/bulk', methods=['POST'])
+def bulk_favorites():
+    #body: {"add": {"people": [1, 2], "planet": [3]}, "remove": {"vehicle": [4]}}, el usuario sale del token
+    body = request.get_json()
+    if body is None:
+        raise APIException('You need to specify the request body as json object', status_code=400)
+    user_id = authorized_user_id(body)
+
+    add = bulk_favorite_ids(body, 'add')
+    remove = bulk_favorite_ids(body, 'remove')
+    total = sum(len(ids) for ids in add.values()) + sum(len(ids) for ids in remove.values())
+    if total > BULK_FAVORITES_MAX_ITEMS:
+        raise APIException('Too many items, the limit is %s' % BULK_FAVORITES_MAX_ITEMS, status_code=400)
+
+    results = []
+    inserts = []
+    added = {}
+    deletes = []
+    for kind, ids in add.items():
+        model, favorite_model, column_name = FAVORITE_KINDS[kind]
+        column = getattr(favorite_model, column_name)
+        ids = list(dict.fromkeys(ids)) #quita repetidos manteniendo el orden
+
+        #una query por tipo para validar todos los ids y otra para ver cuales ya son favoritos
+        found = set(row[0] for row in db.session.query(model.id).filter(model.id.in_(ids)))
+        existing = set(row[0] for row in db.session.query(column).filter(favorite_model.user_id == user_id, column.in_(ids)))
+
+        new_rows = []
+        for id in ids:
+            if id not in found:
+                status = 'not_found'
+            elif id in existing:
+                status = 'exists'
+            else:
+                status = 'added'
+                new_rows.append({'user_id': user_id, column_name: id})
+            results.append({"type": kind, "id": id, "action": "add", "status": status})
+
+        if new_rows:
+            inserts.append((kind, new_rows))
+            added[kind] = set(row[column_name] for row in new_rows)
+
+    for kind, ids in remove.items():
+        model, favorite_model, column_name = FAVORITE_KINDS[kind]
+        column = getattr(favorite_model, column_name)
+        ids = list(dict.fromkeys(ids))
+
+        existing = set(row[0] for row in db.session.query(column).filter(favorite_model.user_id == user_id, column.in_(ids)))
+        existing |= added.get(kind, set()) & set(ids) #lo agregado en este mismo request tambien se puede quitar
+        if existing:
+            deletes.append((kind, existing))
+
+        for id in ids:
+            status = 'removed' if id in existing else 'not_favorite'
+            results.append({"type": kind, "id": id, "action": "remove", "status": status})
+
+    #todo en una sola transaccion
+    try:
+        for kind, new_rows in inserts:
+            model, favorite_model, column_name = FAVORITE_KINDS[kind]
+            db.session.execute(favorite_model.__table__.insert(), new_rows)
+            count_favorites(model, added[kind], 1)
+            record_changes(favorite_model.__tablename__, 'created', sorted(added[kind]), user_id=user_id)
+        for kind, ids in deletes:
+            model, favorite_model, column_name = FAVORITE_KINDS[kind]
+            favorite_model.query.filter(favorite_model.user_id == user_id, getattr(favorite_model, column_name).in_(ids)).delete(synchronize_session=False)
+            count_favorites(model, ids, -1)
+            record_changes(favorite_model.__tablename__, 'deleted', sorted(ids), user_id=user_id)
+        if inserts or deletes:
+            touch_user_favorites(user_id)
+        db.session.commit()
+    except IntegrityError:
+        #otro request agrego el mismo favorito entre la consulta y el insert
+        favorite_conflict(user_id, 'Favorites changed while saving, try again', status_code=409)
+
+    return jsonify({"user_id": user_id, "results": results}), 200
 
 #APIS FAVORITES ALL --------------------------------------------
+def favorites_etag(user_id, version):
+    return 'favorites-%s-v%s' % (user_id, version)
+
 @app.route('/favorites', methods=['POST'])
+@read_only
 def list_favorites():
-    body = request.get_json()
-    user_id = body["user_id"]
-
-    if not user_id:
-        raise APIException('Data missing', status_code=404)
+    body = request.get_json(silent=True)
+    user_id = authorized_user_id(body)
 
-    user = User.query.get(user_id)
-
-    if not user:
+    #una lectura por primary key: version actual + snapshot ya armado
+    snapshot = load_favorites_snapshot(user_id)
+    if snapshot is None:
         raise APIException('User not found', status_code=404)
-
-    user_favorites = FavoritePeople.query.filter_by(user_id = user.id).all() #nos devuelve todas las coincidencias
-    user_favorites_final = list(map(lambda item: item.serialize(), user_favorites))
-
-    user_favorites_planets = FavoritePlanet.query.filter_by(user_id = user.id).all()
-    user_favorites_final_planets = list(map(lambda item: item.serialize(), user_favorites_planets))
-
-    user_favorites_vehicle = FavoriteVehicle.query.filter_by(user_id = user.id).all()
-    user_favorites_final_vehicle = list(map(lambda item: item.serialize(), user_favorites_vehicle))
-    
-    user_favorites_final = user_favorites_final + user_favorites_final_planets + user_favorites_final_vehicle
-
-    return jsonify(user_favorites_final), 201
+    version, snapshot_version, document = snapshot
+    etag = favorites_etag(user_id, version)
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    if snapshot_version != version:
+        #no hay snapshot o quedo viejo: se arma desde las tablas de favoritos y se guarda
+        user, user_favorites_final = load_user_favorites(user_id)
+        if not user:
+            raise APIException('User not found', status_code=404)
+        version = user.favorites_version
+        etag = favorites_etag(user_id, version)
+        document = save_favorites_snapshot(user_id, version, user_favorites_final)
+
+    #?fields=id,people.name,planet.name recorta cada favorito (y los objetos que tiene adentro)
+    fields = parse_fields(request.args.get('fields'))
+    if fields is not None:
+        document = app.json.dumps([project(favorite, fields) for favorite in app.json.loads(document)])
+
+    #el documento ya es json, se manda tal cual
+    response = app.response_class(document, mimetype='application/json')
+    response.set_etag(etag)
+    return response, 201
+
+#APIS CHANGES --------------------------------------------
+CHANGES_MAX_LIMIT = 500
+CHANGES_MAX_WAIT = int(os.getenv('CHANGES_MAX_WAIT', 25)) #segundos maximos de long-poll
+CHANGES_POLL_SECONDS = float(os.getenv('CHANGES_POLL_SECONDS', 0.5))
+CHANGES_STREAM_SECONDS = int(os.getenv('CHANGES_STREAM_SECONDS', 300)) #despues el cliente SSE se reconecta con Last-Event-ID
+#un id mas chico puede llegar a commitearse despues que uno mas grande; solo se muestran
+#los cambios con al menos este tiempo para que el cursor no se saltee ninguno
+CHANGES_SETTLE_SECONDS = float(os.getenv('CHANGES_SETTLE_MS', 1000)) / 1000
+
+#cambios del catalogo que ve cualquiera; los de usuarios y favoritos solo los ve su dueño
+PUBLIC_CHANGE_ENTITIES = ('people', 'planet', 'vehicle')
+
+def read_changes(user_id, since, entities, limit):
+    query = ChangeLog.query.filter(ChangeLog.id > since,
+        ChangeLog.created_at <= datetime.utcnow() - timedelta(seconds=CHANGES_SETTLE_SECONDS),
+        or_(ChangeLog.entity.in_(PUBLIC_CHANGE_ENTITIES),
+            ChangeLog.user_id == user_id,
+            and_(ChangeLog.entity == User.__tablename__, ChangeLog.entity_id == user_id)))
+    if entities:
+        query = query.filter(ChangeLog.entity.in_(entities))
+    changes = [change.serialize() for change in query.order_by(ChangeLog.id).limit(limit)]
+    db.session.rollback() #devuelve la conexion al pool mientras se espera
+    return changes
+
+@app.route('/changes', methods=['GET'])
+@read_only
+def list_changes():
+    #?since=<cursor>&entity=people,favorite_people&limit=100&wait=20 (long-poll)
+    #con Accept: text/event-stream manda los cambios como server-sent events
+    #pide token: ademas del catalogo se ven los cambios del propio usuario y de sus favoritos
+    user_id = authorized_user_id(None)
+    since = request.args.get('since', type=int)
+    if since is None:
+        since = request.headers.get('Last-Event-ID', 0, type=int)
+    entities = [entity for entity in request.args.get('entity', '').split(',') if entity]
+    limit = max(1, min(request.args.get('limit', 100, type=int), CHANGES_MAX_LIMIT))
+
+    if request.accept_mimetypes.best == 'text/event-stream':
+        def events(cursor):
+            deadline = time.monotonic() + CHANGES_STREAM_SECONDS
+            last_sent = time.monotonic()
+            yield 'retry: 2000\n\n'
+            while time.monotonic() < deadline:
+                changes = read_changes(user_id, cursor, entities, limit)
+                for change in changes:
+                    yield 'id: %s\nevent: change\ndata: %s\n\n' % (change["id"], app.json.dumps(change))
+                if changes:
+                    cursor = changes[-1]["id"]
+                    last_sent = time.monotonic()
+                    continue
+                if time.monotonic() - last_sent >= 15:
+                    yield ': keep-alive\n\n' #que los proxies no corten la conexion
+                    last_sent = time.monotonic()
+                time.sleep(CHANGES_POLL_SECONDS)
+        response = Response(stream_with_context(events(since)), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    #long-poll: si no hay nada nuevo se espera hasta wait segundos a que aparezca algo
+    deadline = time.monotonic() + max(0, min(request.args.get('wait', 0, type=float), CHANGES_MAX_WAIT))
+    changes = read_changes(user_id, since, entities, limit)
+    while not changes and time.monotonic() < deadline:
+        time.sleep(CHANGES_POLL_SECONDS)
+        changes = read_changes(user_id, since, entities, limit)
+
+    return jsonify({
+        "results": changes,
+        "next": changes[-1]["id"] if changes else since
+    }), 200
 
 # this only runs if `$ python src/app.py` is executed
 if __name__ == '__main__':
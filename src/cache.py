@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from flask import current_app
+from replicas import router
+
+class LRUCache:
+    #cache en memoria del proceso (cada worker de gunicorn tiene la suya)
+    #max_entries limita la memoria, ttl (segundos) limita cuanto puede durar un dato viejo
+    def __init__(self, max_entries=10000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {
+            "backend": "memory",
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._data),
+            "max_entries": self.max_entries
+        }
+
+class RedisCache:
+    #misma interfaz que LRUCache pero compartida entre workers
+    #client puede ser redis.Redis o cualquier objeto con get/setex/delete/scan_iter
+    def __init__(self, client, ttl=300, prefix='swapi:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    def set(self, key, value):
+        self.client.setex(self.prefix + key, self.ttl, json.dumps(value))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+    def stats(self):
+        #redis hace sus propias evictions (maxmemory-policy), aca no las vemos
+        return {
+            "backend": "redis",
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": None,
+            "size": None,
+            "max_entries": None
+        }
+
+def cache_from_env():
+    ttl = int(os.getenv('CACHE_TTL', 300))
+    redis_url = os.getenv('CACHE_REDIS_URL')
+    if redis_url:
+        import redis #solo se necesita si se configura CACHE_REDIS_URL
+        return RedisCache(redis.Redis.from_url(redis_url), ttl=ttl)
+    return LRUCache(max_entries=int(os.getenv('CACHE_MAX_ENTRIES', 10000)), ttl=ttl)
+
+def entity_key(model, id):
+    return '%s:%s' % (model.__tablename__, id)
+
+def setup_entity_cache(app, cache, on_invalidate=None):
+    #la cache de User/People/Planet/Vehicle serializados que usa invalidate_entity (API y admin)
+    #on_invalidate(model, id) se llama despues de marcar la entrada (ej. el indice de /search)
+    app.extensions['entity_cache'] = (cache, on_invalidate)
+
+def invalidate_entity(model, id):
+    #llamar despues del commit de cualquier cambio a una de esas filas
+    #en vez de borrar la entrada deja una marca: hasta stale_until no se llena con lecturas de replicas
+    cache, on_invalidate = current_app.extensions['entity_cache']
+    cache.set(entity_key(model, id), {"stale_until": time.time() + router.max_lag_seconds})
+    if on_invalidate is not None:
+        on_invalidate(model, id)
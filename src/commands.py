@@ -0,0 +1,185 @@
+import time
+import random
+from datetime import datetime, timedelta
+import click
+import passwords
+from importer import IMPORT_ENTITIES, read_records, import_records
+from flask import json
+from flask.json.provider import DefaultJSONProvider
+from json_provider import FastJSONProvider, orjson
+from models import db, User, People, Planet, Vehicle, FAVORITE_KINDS, FavoritesSnapshot, ChangeLog, rebuild_favorite_counts, load_user_favorites, save_favorites_snapshot
+
+SEED_CHUNK_SIZE = 5000
+
+def seed_rows(model, count, make_row):
+    #inserta count filas nuevas de a SEED_CHUNK_SIZE y devuelve sus ids
+    start = (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+    for first in range(start, start + count, SEED_CHUNK_SIZE):
+        last = min(first + SEED_CHUNK_SIZE, start + count)
+        db.session.execute(model.__table__.insert(), [make_row(number) for number in range(first, last)])
+        db.session.commit()
+    #los ids los pone la base (en postgres la secuencia puede ir adelantada), se leen de vuelta
+    return [row[0] for row in db.session.query(model.id).filter(model.id >= start)]
+
+def setup_commands(app):
+    #comandos de flask: flask import-catalog people swapi_people.ndjson
+
+    @app.cli.command('seed-db')
+    @click.option('--users', default=1000, show_default=True)
+    @click.option('--people', default=10000, show_default=True)
+    @click.option('--planets', default=10000, show_default=True)
+    @click.option('--vehicles', default=10000, show_default=True)
+    @click.option('--favorites-per-user', default=10, show_default=True, help='Per favorite type')
+    @click.option('--seed', 'random_seed', default=42, show_default=True)
+    def seed_db(users, people, planets, vehicles, favorites_per_user, random_seed):
+        #datos sinteticos para benchmarks (ver bench/loadtest.py); agrega filas, no borra nada
+        rng = random.Random(random_seed)
+        start = time.perf_counter()
+        user_ids = seed_rows(User, users, lambda n: {
+            "email": "bench-user-%s@example.com" % n, "name": "Bench User %s" % n, "password": "bench", "is_active": True})
+        seed_rows(People, people, lambda n: {
+            "name": "Bench People %s" % n, "mass": rng.randint(20, 200), "height": rng.randint(60, 250),
+            "hair_color": rng.choice(['black', 'blond', 'brown', 'none']), "skin_color": rng.choice(['fair', 'dark', 'green']),
+            "eye_color": rng.choice(['blue', 'brown', 'yellow']), "birth_year": "%sBBY" % rng.randint(1, 900),
+            "gender": rng.choice(['male', 'female', 'n/a'])})
+        seed_rows(Planet, planets, lambda n: {
+            "name": "Bench Planet %s" % n, "diameter": rng.randint(1000, 20000), "rotation_period": rng.randint(10, 40),
+            "orbital_period": rng.randint(200, 600), "gravity": rng.randint(1, 3), "population": rng.randint(0, 10 ** 9),
+            "climate": rng.choice(['arid', 'temperate', 'frozen', 'murky']), "terrain": rng.choice(['desert', 'grasslands', 'tundra', 'swamp']),
+            "surface_water": str(rng.randint(0, 100))})
+        seed_rows(Vehicle, vehicles, lambda n: {
+            "name": "Bench Vehicle %s" % n, "model": "Model %s" % rng.randint(1, 500), "manufacturer": rng.choice(['Incom', 'SoroSuub', 'Kuat', 'Sienar']),
+            "cost_in_credits": rng.randint(1000, 10 ** 6), "length": rng.randint(1, 100), "crew": rng.randint(1, 50), "passengers": rng.randint(0, 100)})
+
+        favorites = 0
+        for kind, (model, favorite_model, column) in FAVORITE_KINDS.items():
+            #los favoritos salen de todo el catalogo, no solo de lo recien creado:
+            #--people 0 --planets 0 --vehicles 0 agrega usuarios con favoritos a una base ya sembrada
+            catalog = [row[0] for row in db.session.query(model.id)]
+            fan_out = min(favorites_per_user, len(catalog))
+            rows = []
+            for user_id in user_ids:
+                for target_id in rng.sample(catalog, fan_out):
+                    rows.append({"user_id": user_id, column: target_id})
+                if len(rows) >= SEED_CHUNK_SIZE:
+                    db.session.execute(favorite_model.__table__.insert(), rows)
+                    db.session.commit()
+                    favorites += len(rows)
+                    rows = []
+            if rows:
+                db.session.execute(favorite_model.__table__.insert(), rows)
+                db.session.commit()
+                favorites += len(rows)
+        rebuild_favorite_counts()
+
+        click.echo('seeded %s users, %s people, %s planets, %s vehicles, %s favorites in %.1fs' % (
+            users, people, planets, vehicles, favorites, time.perf_counter() - start))
+
+    @app.cli.command('import-catalog')
+    @click.argument('entity', type=click.Choice(list(IMPORT_ENTITIES)))
+    @click.argument('file', type=click.File('r', encoding='utf-8'))
+    @click.option('--format', 'import_format', type=click.Choice(['ndjson', 'csv']), default=None, help='Defaults to the file extension')
+    @click.option('--chunk-size', default=5000, show_default=True)
+    def import_catalog(entity, file, import_format, chunk_size):
+        if import_format is None:
+            import_format = 'csv' if file.name.endswith('.csv') else 'ndjson'
+        report = import_records(IMPORT_ENTITIES[entity], read_records(file, import_format), chunk_size=chunk_size)
+        click.echo('%s: %s imported, %s invalid, %ss (%s rows/s)' % (
+            entity, report['imported'], report['invalid'], report['seconds'], report['rows_per_second']))
+        for error in report['errors']:
+            click.echo('  line %s: %s' % (error['line'], error['error']))
+
+    @app.cli.command('rebuild-popularity')
+    def rebuild_popularity():
+        #recalcula favorite_count desde las tablas de favoritos (si quedo desfasado)
+        rebuild_favorite_counts()
+        click.echo('favorite counts rebuilt')
+
+    @app.cli.command('check-favorites-snapshots')
+    @click.option('--fix', is_flag=True, help='Rewrite the snapshots that do not match')
+    @click.option('--all-users', is_flag=True, help='Also build snapshots for users that have none')
+    def check_favorites_snapshots(fix, all_users):
+        #arma de nuevo cada snapshot desde las tablas de favoritos y lo compara con el guardado
+        query = db.session.query(User.id) if all_users else db.session.query(FavoritesSnapshot.user_id)
+        user_ids = [row[0] for row in query]
+        report = {"checked": 0, "ok": 0, "stale": 0, "mismatch": 0, "missing": 0, "fixed": 0}
+        for user_id in user_ids:
+            report["checked"] += 1
+            snapshot = FavoritesSnapshot.query.get(user_id)
+            user, favorites = load_user_favorites(user_id)
+            if user is None:
+                continue
+            if snapshot is None:
+                problem = "missing"
+            elif snapshot.version != user.favorites_version:
+                problem = "stale" #esperable: se rearma en la proxima lectura
+            elif json.loads(snapshot.document) != json.loads(json.dumps(favorites)):
+                problem = "mismatch" #la version coincide pero el contenido no: algun cambio no subio favorites_version
+                click.echo('user %s: snapshot v%s does not match the favorites tables' % (user_id, snapshot.version))
+            else:
+                report["ok"] += 1
+                continue
+            report[problem] += 1
+            if fix:
+                if problem == "mismatch":
+                    #el update de save_favorites_snapshot solo pisa versiones mas viejas
+                    db.session.delete(snapshot)
+                    db.session.commit()
+                save_favorites_snapshot(user_id, user.favorites_version, favorites)
+                report["fixed"] += 1
+            db.session.rollback() #suelta las filas cargadas, la sesion no crece con cada usuario
+        click.echo(' '.join('%s=%s' % item for item in report.items()))
+
+    @app.cli.command('prune-changes')
+    @click.option('--days', default=7, show_default=True, help='Keep this many days of /changes history')
+    def prune_changes(days):
+        #el change_log solo crece; los consumidores que se atrasen mas que esto tienen que resincronizar todo
+        deleted = ChangeLog.query.filter(ChangeLog.created_at < datetime.utcnow() - timedelta(days=days)).delete(synchronize_session=False)
+        db.session.commit()
+        click.echo('%s changes deleted' % deleted)
+
+    @app.cli.command('bench-passwords')
+    @click.option('--seconds', default=5.0, show_default=True)
+    def bench_passwords(seconds):
+        #logins por segundo en un core: verify_password directo, sin el pool de threads
+        stored = passwords._hash('correct horse battery staple')
+        start = time.perf_counter()
+        logins = 0
+        while time.perf_counter() - start < seconds:
+            passwords._verify(stored, 'correct horse battery staple')
+            logins += 1
+        elapsed = time.perf_counter() - start
+        click.echo('scrypt n=%s r=%s p=%s: %.1f logins/s per core (%.1f ms each)' % (
+            passwords.SCRYPT_N, passwords.SCRYPT_R, passwords.SCRYPT_P, logins / elapsed, 1000 * elapsed / logins))
+
+    @app.cli.command('bench-serialize')
+    @click.option('--entity', type=click.Choice(list(IMPORT_ENTITIES)), default='people', show_default=True)
+    @click.option('--rows', default=2000, show_default=True)
+    @click.option('--repeat', default=20, show_default=True)
+    def bench_serialize(entity, rows, repeat):
+        #ms por respuesta de rows filas: query.all() + serialize() + el json de Flask contra
+        #las tuplas de serialize_columns + FastJSONProvider (lo que hacen los listados); usar una base sembrada
+        model = IMPORT_ENTITIES[entity]
+        default_json = DefaultJSONProvider(app)
+        fast_json = FastJSONProvider(app)
+        columns = [getattr(model, column) for column in model.serialize_columns]
+
+        def orm_objects():
+            return default_json.dumps([row.serialize() for row in model.query.order_by(model.id).limit(rows)])
+
+        def column_tuples():
+            result = db.session.query(*columns).order_by(model.id).limit(rows)
+            return fast_json.dumps([dict(zip(model.serialize_columns, row)) for row in result])
+
+        found = db.session.query(model.id).limit(rows).count()
+        if found < rows:
+            raise click.ClickException('only %s %s in the database, run `flask seed-db` first' % (found, entity))
+        for name, path in (('query.all() + serialize() + json', orm_objects), ('columns + fast json', column_tuples)):
+            path() #calienta la conexion y las queries compiladas
+            start = time.perf_counter()
+            for _ in range(repeat):
+                size = len(path())
+                db.session.expunge_all() #cada vuelta vuelve a armar los objetos
+            elapsed = time.perf_counter() - start
+            click.echo('%s: %.1f ms per %s rows (%s bytes)' % (name, 1000 * elapsed / repeat, rows, size))
+        click.echo('json: %s' % ('orjson' if orjson is not None else 'stdlib'))
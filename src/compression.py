@@ -0,0 +1,66 @@
+import os
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError: #brotli es opcional, sin el solo se ofrece gzip
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'application/javascript')
+
+def compressor(encoding, gzip_level, brotli_quality):
+    #devuelve (compress(chunk), finish()) para comprimir de a partes
+    if encoding == 'br':
+        engine = brotli.Compressor(quality=brotli_quality)
+        return engine.process, engine.finish
+    engine = zlib.compressobj(gzip_level, zlib.DEFLATED, 31) #31 = formato gzip
+    return engine.compress, engine.flush
+
+def compress_stream(chunks, compress, finish):
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compress(chunk)
+        if data:
+            yield data
+    yield finish()
+
+def setup_compression(app):
+    #gzip/brotli segun Accept-Encoding para respuestas de texto de al menos COMPRESS_MIN_SIZE bytes
+    min_size = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+    gzip_level = int(os.getenv('COMPRESS_GZIP_LEVEL', 6))
+    brotli_quality = int(os.getenv('COMPRESS_BROTLI_QUALITY', 5)) #11 es el maximo pero muy lento para cada request
+    if os.getenv('COMPRESS_ENABLED', '1').lower() not in ('1', 'true', 'yes'):
+        return
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+    @app.after_request
+    def compress_response(response):
+        mimetype = response.mimetype or ''
+        if not (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_MIMETYPES) or mimetype == 'text/event-stream':
+            return response #los eventos SSE tienen que salir de a uno, sin esperar a llenar el buffer
+        if response.direct_passthrough or response.status_code < 200 or response.status_code in (204, 304) \
+                or 'Content-Encoding' in response.headers:
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(offered)
+        if encoding is None:
+            return response
+
+        compress, finish = compressor(encoding, gzip_level, brotli_quality)
+        if response.is_streamed:
+            #exportaciones: se comprime a medida que salen los chunks
+            response.response = compress_stream(response.response, compress, finish)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < min_size:
+                return response
+            response.set_data(compress(data) + finish())
+        response.headers['Content-Encoding'] = encoding
+        #el ETag es del contenido sin comprimir: pasa a ser debil, como hace nginx
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
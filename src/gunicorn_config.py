@@ -0,0 +1,24 @@
+# Configuracion de gunicorn: gunicorn wsgi --chdir ./src/ -c src/gunicorn_config.py
+# GUNICORN_WORKER_CLASS=gevent activa el modo async: cada worker atiende muchos requests a la vez
+# y mientras uno espera a la base de datos los demas siguen corriendo.
+import os
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+workers = int(os.getenv('WEB_CONCURRENCY', 1))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000)) #solo para gevent
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        #gunicorn ya parchea sockets/threads; psycopg2 es C y necesita su propio parche para no bloquear
+        try:
+            from psycogreen.gevent import patch_psycopg
+        except ImportError:
+            server.log.warning('psycogreen is not installed, Postgres queries will block the gevent worker')
+        else:
+            patch_psycopg()
+
+def post_worker_init(worker):
+    #el indice de /search se arma en background apenas el worker carga la app, no en la primera busqueda
+    from app import app, search_index
+    search_index.start(app)
@@ -0,0 +1,115 @@
+import csv
+import json
+import time
+from datetime import datetime
+from sqlalchemy import Integer, select
+from sqlalchemy.dialects import postgresql, sqlite, mysql
+from models import db, People, Planet, Vehicle, touch_favorites_where, record_row_changes
+
+IMPORT_ENTITIES = {
+    'people': People,
+    'planets': Planet,
+    'vehicles': Vehicle
+}
+MAX_REPORTED_ERRORS = 20
+
+def read_records(stream, import_format):
+    #stream es un archivo de texto; devuelve dicts de a uno, sin cargar todo en memoria
+    if import_format == 'csv':
+        return csv.DictReader(stream)
+    return (parse_json_line(line) for line in stream if line.strip())
+
+def parse_json_line(line):
+    #una linea invalida no corta la importacion: el error va al reporte (ver clean_record)
+    try:
+        return json.loads(line)
+    except ValueError as error:
+        return error
+
+def clean_record(model, record):
+    #devuelve (fila, None) o (None, mensaje de error)
+    if isinstance(record, ValueError):
+        return None, 'invalid json: %s' % record
+    if not isinstance(record, dict):
+        return None, 'each line must be a json object'
+    row = {}
+    for name in model.serialize_columns:
+        if name == 'id':
+            continue #el id lo asigna la base, el upsert es por name
+        value = record.get(name)
+        if value is None or value == '':
+            return None, 'missing %s' % name
+        column_type = model.__table__.c[name].type
+        if isinstance(column_type, Integer):
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                return None, '%s must be an integer' % name
+        else:
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                value = str(value)
+            if not isinstance(value, str):
+                return None, '%s must be a string' % name
+            #en Postgres un valor mas largo que la columna es un DataError que aborta el chunk entero
+            if column_type.length is not None and len(value) > column_type.length:
+                return None, '%s is longer than %s characters' % (name, column_type.length)
+        row[name] = value
+    return row, None
+
+def upsert_statement(model):
+    #INSERT ... ON CONFLICT (name) DO UPDATE, segun la base que se use
+    table = model.__table__
+    columns = [name for name in model.serialize_columns if name not in ('id', 'name')]
+    dialect = db.engine.dialect.name
+    #una fila actualizada tambien cambia de version (ETag) y de updated_at
+    touched = {'version': table.c.version + 1, 'updated_at': datetime.utcnow()}
+    if dialect == 'postgresql' or dialect == 'sqlite':
+        insert = postgresql.insert(table) if dialect == 'postgresql' else sqlite.insert(table)
+        values = {name: insert.excluded[name] for name in columns}
+        return insert.on_conflict_do_update(index_elements=['name'], set_=dict(values, **touched))
+    if dialect == 'mysql':
+        insert = mysql.insert(table)
+        values = {name: insert.inserted[name] for name in columns}
+        return insert.on_duplicate_key_update(dict(values, **touched))
+    raise ValueError('Bulk import is not supported for %s' % dialect)
+
+def import_records(model, records, chunk_size=1000):
+    #valida y guarda de a chunk_size filas, cada chunk en su propia transaccion (executemany)
+    statement = upsert_statement(model)
+    report = {"received": 0, "imported": 0, "invalid": 0, "errors": []}
+    start = time.perf_counter()
+
+    chunk = {}
+    for line_number, record in enumerate(records, start=1):
+        report["received"] += 1
+        row, error = clean_record(model, record)
+        if error is not None:
+            report["invalid"] += 1
+            if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                report["errors"].append({"line": line_number, "error": error})
+            continue
+        chunk[row['name']] = row #el mismo name dos veces en un chunk: gana el ultimo
+        if len(chunk) >= chunk_size:
+            report["imported"] += write_chunk(model, statement, chunk)
+            chunk = {}
+    if chunk:
+        report["imported"] += write_chunk(model, statement, chunk)
+
+    seconds = time.perf_counter() - start
+    report["seconds"] = round(seconds, 3)
+    report["rows_per_second"] = round(report["imported"] / seconds) if seconds else None
+    return report
+
+def write_chunk(model, statement, chunk):
+    names = list(chunk)
+    #para el change_log: los que ya existian se actualizan, el resto se crea
+    existing = set(db.session.scalars(select(model.name).where(model.name.in_(names))))
+    db.session.execute(statement, list(chunk.values()))
+    #los favoritos que muestran estas filas quedan viejos (snapshots y ETags de /favorites), en la misma transaccion
+    touch_favorites_where(model, model.name.in_(names))
+    #/changes recibe el estado nuevo de cada fila con su id, que recien ahora se conoce
+    columns = [model.__table__.c[name] for name in model.serialize_columns]
+    rows = db.session.execute(select(*columns).where(model.name.in_(names))).mappings()
+    record_row_changes(model.__tablename__, [('updated' if row['name'] in existing else 'created', dict(row)) for row in rows])
+    db.session.commit()
+    return len(chunk)
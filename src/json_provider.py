@@ -0,0 +1,34 @@
+import os
+import json
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError: #orjson es opcional, sin el se usa json de la libreria estandar
+    orjson = None
+
+class FastJSONProvider(DefaultJSONProvider):
+    #sin ordenar keys ni espacios: menos CPU y respuestas mas chicas
+    sort_keys = False
+    compact = True
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.dumps(obj, default=self.default).decode()
+        kwargs.setdefault('default', self.default)
+        kwargs.setdefault('separators', (',', ':'))
+        return json.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps(obj), mimetype=self.mimetype)
+
+def setup_json(app):
+    #JSON_PROVIDER=default vuelve al proveedor normal de Flask
+    if os.getenv('JSON_PROVIDER', 'fast') == 'fast':
+        app.json = FastJSONProvider(app)
@@ -0,0 +1,117 @@
+import os
+import time
+import threading
+from flask import g, request, has_request_context, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+class Histogram:
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series = {} #labels -> [contador por bucket..., suma, cantidad]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                label_text = ','.join('%s="%s"' % pair for pair in labels)
+                for i, bound in enumerate(self.buckets):
+                    lines.append('%s_bucket{%s,le="%s"} %s' % (self.name, label_text, bound, series[i]))
+                lines.append('%s_bucket{%s,le="+Inf"} %s' % (self.name, label_text, series[-1]))
+                lines.append('%s_sum{%s} %s' % (self.name, label_text, series[-2]))
+                lines.append('%s_count{%s} %s' % (self.name, label_text, series[-1]))
+        return lines
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s counter' % self.name]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                label_text = ','.join('%s="%s"' % pair for pair in labels)
+                lines.append('%s{%s} %s' % (self.name, label_text, value))
+        return lines
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Request latency by endpoint', LATENCY_BUCKETS)
+REQUEST_QUERIES = Histogram('http_request_sql_queries', 'SQL statements executed per request', QUERY_COUNT_BUCKETS)
+REQUEST_SQL_TIME = Histogram('http_request_sql_duration_seconds', 'Total SQL time per request', LATENCY_BUCKETS)
+
+#otros modulos pueden registrar sus propias metricas aca (deben tener render())
+REGISTRY = [REQUEST_LATENCY, REQUEST_QUERIES, REQUEST_SQL_TIME]
+
+#cuenta queries de cualquier engine (tambien replicas) y las asigna al request actual
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    if not has_request_context() or 'sql_count' not in g:
+        return
+    g.sql_count += 1
+    g.sql_time += elapsed
+    if g.sql_statements is not None and len(g.sql_statements) < 50:
+        g.sql_statements.append((round(elapsed * 1000, 2), statement))
+
+def setup_metrics(app, extra_lines=None):
+    #extra_lines: funcion opcional que devuelve lineas extra para /metrics (ej. estado del pool)
+    slow_request_ms = float(os.getenv('SLOW_REQUEST_MS', 0)) #0 = log de requests lentos desactivado
+
+    @app.before_request
+    def start_request_metrics():
+        g.request_start = time.perf_counter()
+        g.sql_count = 0
+        g.sql_time = 0.0
+        g.sql_statements = [] if slow_request_ms else None
+
+    @app.after_request
+    def record_request_metrics(response):
+        if 'request_start' not in g:
+            return response
+        elapsed = time.perf_counter() - g.request_start
+        labels = (('endpoint', request.endpoint or 'unknown'), ('method', request.method))
+        REQUEST_LATENCY.observe(labels, elapsed)
+        REQUEST_QUERIES.observe(labels, g.sql_count)
+        REQUEST_SQL_TIME.observe(labels, g.sql_time)
+
+        if slow_request_ms and elapsed * 1000 >= slow_request_ms:
+            statements = '\n'.join('  %sms %s' % item for item in g.sql_statements)
+            app.logger.warning('Slow request %s %s: %.1fms, %s queries, %.1fms in SQL\n%s',
+                request.method, request.path, elapsed * 1000, g.sql_count, g.sql_time * 1000, statements)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        lines = []
+        for metric in REGISTRY:
+            lines.extend(metric.render())
+        if extra_lines is not None:
+            lines.extend(extra_lines())
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
@@ -1,8 +1,27 @@
+from datetime import datetime
+from operator import attrgetter
+from flask import json
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import select, literal, union_all, and_
+from sqlalchemy.exc import IntegrityError
+from replicas import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+def column_serializer(columns):
+    #genera serialize() una sola vez por clase: un attrgetter lee todas las columnas de una vez
+    getter = attrgetter(*columns)
+    if len(columns) == 1:
+        return lambda self: {columns[0]: getter(self)}
+    return lambda self: dict(zip(columns, getter(self)))
+
+def filter_indexes(table, columns):
+    #indices (columna, id) para los listados filtrados (LIST_FILTERS en app.py):
+    #WHERE columna = x AND id > after ORDER BY id LIMIT n se resuelve leyendo solo las filas de la pagina
+    return tuple(db.Index('ix_%s_%s_id' % (table, column), column, 'id') for column in columns)
 
 class User(db.Model):
+    __table_args__ = filter_indexes('user', ['name', 'is_active']) #email ya es unico
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
     #nullable=False significa que no se puede dejar en blanco
@@ -10,23 +29,27 @@ class User(db.Model):
     password = db.Column(db.String(250), unique=False, nullable=False)
     is_active = db.Column(db.Boolean(), unique=False, nullable=False)
     name = db.Column(db.String(120), unique=False, nullable=False)
-    favorite_people = db.relationship('FavoritePeople', backref = 'user', lazy=True)
-    favorite_vehicle = db.relationship('FavoriteVehicle', backref = 'user', lazy=True)
-    favorite_planet = db.relationship('FavoritePlanet', backref = 'user', lazy=True)
+    #version sube sola con cada UPDATE del ORM y arma el ETag; updated_at es el Last-Modified
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow, server_default=db.func.now())
+    __mapper_args__ = {'version_id_col': version}
+    #sube cada vez que cambian sus favoritos (o algo que se ve en ellos), ETag de /favorites
+    favorites_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    #lazy='joined' en el backref: al cargar un favorito se trae el usuario en la misma query
+    favorite_people = db.relationship('FavoritePeople', backref = db.backref('user', lazy='joined'), lazy=True)
+    favorite_vehicle = db.relationship('FavoriteVehicle', backref = db.backref('user', lazy='joined'), lazy=True)
+    favorite_planet = db.relationship('FavoritePlanet', backref = db.backref('user', lazy='joined'), lazy=True)
     
     #cambia la ubicacion de la memoria
     def __repr__(self):
         return '<User %r>' % self.name
 
-    def serialize(self):
-        return {
-            "id": self.id,
-            "email": self.email,
-            "name": self.name
-            # do not serialize the password, its a security breach
-        }
+    #columnas que se devuelven en el json, do not serialize the password, its a security breach
+    serialize_columns = ('id', 'email', 'name')
+    serialize = column_serializer(serialize_columns)
 
 class People(db.Model):
+    __table_args__ = filter_indexes('people', ['gender', 'eye_color', 'hair_color', 'skin_color', 'birth_year'])
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), unique=True, nullable=False)
     mass = db.Column(db.Integer, unique=False, nullable=False)
@@ -36,42 +59,46 @@ class People(db.Model):
     eye_color = db.Column(db.String(50), unique=False, nullable=False)
     birth_year = db.Column(db.String(50), unique=False, nullable=False)
     gender = db.Column(db.String(50), unique=False, nullable=False)
-    favorite_people = db.relationship('FavoritePeople', backref = 'people', lazy=True)
+    #version sube sola con cada UPDATE del ORM y arma el ETag; updated_at es el Last-Modified
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow, server_default=db.func.now(), index=True) #max(updated_at) del chequeo de /search
+    __mapper_args__ = {'version_id_col': version}
+    #cuantos usuarios lo tienen de favorito, lo mantienen los endpoints de favoritos (ver /popular)
+    favorite_count = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
+    favorite_people = db.relationship('FavoritePeople', backref = db.backref('people', lazy='joined'), lazy=True)
 
-    def serialize(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "mass": self.mass,
-            "height": self.height,
-            "hair_color": self.hair_color,
-            "skin_color": self.skin_color,
-            "eye_color": self.eye_color,
-            "birth_year": self.birth_year,
-            "gender": self.gender
-            # do not serialize the password, its a security breach
-        }
+    #columnas que se devuelven en el json
+    serialize_columns = ('id', 'name', 'mass', 'height', 'hair_color', 'skin_color', 'eye_color', 'birth_year', 'gender')
+    serialize = column_serializer(serialize_columns)
 
 class FavoritePeople(db.Model):
+    #un usuario no puede tener el mismo favorito dos veces; el indice tambien sirve para buscar por user_id
+    __table_args__ = (db.Index('ix_favorite_people_user_id_people_id', 'user_id', 'people_id', unique=True),)
     id = db.Column(db.Integer, primary_key = True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    people_id = db.Column(db.Integer, db.ForeignKey('people.id'), nullable=False)
+    people_id = db.Column(db.Integer, db.ForeignKey('people.id'), nullable=False, index=True) #quienes lo tienen de favorito
 
     def serialize(self):
+        return FavoritePeople.serialize_parts(self.id, self.user.serialize(), self.people.serialize())
+
+    #arma el json a partir del usuario y el personaje ya serializados (lo usa tambien favorites_union)
+    @staticmethod
+    def serialize_parts(id, user, people):
         return {
-            "id": self.id,
-            "user_id": self.user_id,
-            "people_id": self.people_id,
-            "people_name": People.query.get(self.people_id).serialize()["name"],
-            "user_name": User.query.get(self.user_id).serialize()["name"],
-            "user": User.query.get(self.user_id).serialize(),
-            "people": People.query.get(self.people_id).serialize()
+            "id": id,
+            "user_id": user["id"],
+            "people_id": people["id"],
+            "people_name": people["name"],
+            "user_name": user["name"],
+            "user": user,
+            "people": people
         }
 #recomendacion separar los favoritos en tablas distintas
 # new_favorite = FavoritePeople(user_id = db.Column....., )
 # new_favorite.user -> obtengo toda la info del usuario q tiene a ese favorito en su lista y tmb obtengo sus metodos (serialize)
 
 class Vehicle(db.Model):
+    __table_args__ = filter_indexes('vehicle', ['manufacturer', 'model'])
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(250), unique=True, nullable=False)
     model = db.Column(db.String(50), unique=False, nullable=False)
@@ -80,31 +107,34 @@ class Vehicle(db.Model):
     length = db.Column(db.Integer, unique=False, nullable=False)
     crew = db.Column(db.Integer, unique=False, nullable=False)
     passengers = db.Column(db.Integer, unique=False, nullable=False)
-    favorite_vehicle = db.relationship('FavoriteVehicle', backref = 'vehicle', lazy=True)
+    #version sube sola con cada UPDATE del ORM y arma el ETag; updated_at es el Last-Modified
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow, server_default=db.func.now(), index=True) #max(updated_at) del chequeo de /search
+    __mapper_args__ = {'version_id_col': version}
+    #cuantos usuarios lo tienen de favorito, lo mantienen los endpoints de favoritos (ver /popular)
+    favorite_count = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
+    favorite_vehicle = db.relationship('FavoriteVehicle', backref = db.backref('vehicle', lazy='joined'), lazy=True)
 
-    def serialize(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "model": self.model,
-            "manufacturer": self.manufacturer,
-            "cost_in_credits": self.cost_in_credits,
-            "length": self.length,
-            "crew": self.crew,
-            "passengers": self.passengers
-            # do not serialize the password, its a security breach
-        }
+    #columnas que se devuelven en el json
+    serialize_columns = ('id', 'name', 'model', 'manufacturer', 'cost_in_credits', 'length', 'crew', 'passengers')
+    serialize = column_serializer(serialize_columns)
 
 class FavoriteVehicle(db.Model):
+    #un usuario no puede tener el mismo favorito dos veces; el indice tambien sirve para buscar por user_id
+    __table_args__ = (db.Index('ix_favorite_vehicle_user_id_vehicle_id', 'user_id', 'vehicle_id', unique=True),)
     id = db.Column(db.Integer, primary_key = True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'), nullable=False)
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'), nullable=False, index=True) #quienes lo tienen de favorito
 
     def serialize(self):
+        return FavoriteVehicle.serialize_parts(self.id, self.user.serialize(), self.vehicle.serialize())
+
+    @staticmethod
+    def serialize_parts(id, user, vehicle):
         return {
-            "id": self.id,
-            "user_id": self.user_id,
-            "vehicle": Vehicle.query.get(self.vehicle_id).serialize()
+            "id": id,
+            "user_id": user["id"],
+            "vehicle": vehicle
         }
 
 #recomendacion separar los favoritos en tablas distintas
@@ -112,6 +142,7 @@ class FavoriteVehicle(db.Model):
 # new_favorite.user -> obtengo toda la info del usuario q tiene a ese favorito en su lista y tmb obtengo sus metodos (serialize)
 
 class Planet(db.Model):
+    __table_args__ = filter_indexes('planet', ['climate', 'terrain', 'surface_water'])
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), unique=True, nullable=False)
     diameter = db.Column(db.Integer, unique=False, nullable=False)
@@ -122,32 +153,220 @@ class Planet(db.Model):
     climate = db.Column(db.String(50), unique=False, nullable=False)
     terrain = db.Column(db.String(50), unique=False, nullable=False)
     surface_water = db.Column(db.String(50), unique=False, nullable=False)
-    favorite_planet = db.relationship('FavoritePlanet', backref = 'planet', lazy=True)
+    #version sube sola con cada UPDATE del ORM y arma el ETag; updated_at es el Last-Modified
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow, server_default=db.func.now(), index=True) #max(updated_at) del chequeo de /search
+    __mapper_args__ = {'version_id_col': version}
+    #cuantos usuarios lo tienen de favorito, lo mantienen los endpoints de favoritos (ver /popular)
+    favorite_count = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
+    favorite_planet = db.relationship('FavoritePlanet', backref = db.backref('planet', lazy='joined'), lazy=True)
 
-    def serialize(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "diameter": self.diameter,
-            "rotation_period": self.rotation_period,
-            "orbital_period": self.orbital_period,
-            "gravity": self.gravity,
-            "population": self.population,
-            "climate": self.climate,
-            "terrain": self.terrain,
-            "surface_water": self.surface_water
-            # do not serialize the password, its a security breach
-        }
+    #columnas que se devuelven en el json
+    serialize_columns = ('id', 'name', 'diameter', 'rotation_period', 'orbital_period', 'gravity', 'population', 'climate', 'terrain', 'surface_water')
+    serialize = column_serializer(serialize_columns)
 
 class FavoritePlanet(db.Model):
+    #un usuario no puede tener el mismo favorito dos veces; el indice tambien sirve para buscar por user_id
+    __table_args__ = (db.Index('ix_favorite_planet_user_id_planet_id', 'user_id', 'planet_id', unique=True),)
     id = db.Column(db.Integer, primary_key = True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    planet_id = db.Column(db.Integer, db.ForeignKey('planet.id'), nullable=False)
+    planet_id = db.Column(db.Integer, db.ForeignKey('planet.id'), nullable=False, index=True) #quienes lo tienen de favorito
+
+    def serialize(self):
+        return FavoritePlanet.serialize_parts(self.id, self.user.serialize(), self.planet.serialize())
+
+    @staticmethod
+    def serialize_parts(id, user, planet):
+        return {
+            "id": id,
+            "user_id": user["id"],
+            "user": user,
+            "planet": planet
+        }
+
+class FavoritesSnapshot(db.Model):
+    #json de /favorites ya armado para cada usuario; vale mientras version == user.favorites_version
+    #los endpoints que cambian favoritos (o algo que se ve en ellos) suben favorites_version y lo invalidan
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+    document = db.Column(db.Text, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ChangeLog(db.Model):
+    #feed de cambios (GET /changes): una fila por alta/cambio/baja, en la misma transaccion que la escritura
+    #id es el cursor; entity es el nombre de la tabla (en favoritos entity_id es el id del personaje/planeta/vehiculo)
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    entity = db.Column(db.String(30), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    action = db.Column(db.String(10), nullable=False) #created, updated, deleted
+    user_id = db.Column(db.Integer, nullable=True)
+    data = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
 
     def serialize(self):
         return {
             "id": self.id,
+            "entity": self.entity,
+            "entity_id": self.entity_id,
+            "action": self.action,
             "user_id": self.user_id,
-            "user": User.query.get(self.user_id).serialize(),
-            "planet": Planet.query.get(self.planet_id).serialize()
-        }
\ No newline at end of file
+            "data": json.loads(self.data) if self.data is not None else None,
+            "created_at": self.created_at.isoformat() + 'Z'
+        }
+
+#tipos de favorito: nombre -> (modelo, tabla de favoritos, columna con el id del modelo)
+FAVORITE_KINDS = {
+    'people': (People, FavoritePeople, 'people_id'),
+    'planet': (Planet, FavoritePlanet, 'planet_id'),
+    'vehicle': (Vehicle, FavoriteVehicle, 'vehicle_id')
+}
+
+def favorites_union():
+    #todas las tablas de favoritos como una sola (id, user_id, kind, target_id, position) con UNION ALL
+    #position mantiene el orden de siempre: primero people, despues planet, despues vehicle
+    selects = []
+    for position, (kind, (model, favorite_model, column)) in enumerate(FAVORITE_KINDS.items()):
+        selects.append(select(
+            favorite_model.id.label('id'),
+            favorite_model.user_id.label('user_id'),
+            literal(kind).label('kind'),
+            getattr(favorite_model, column).label('target_id'),
+            literal(position).label('position')
+        ))
+    return union_all(*selects).subquery('favorite')
+
+def load_user_favorites(user_id):
+    #usuario + todos sus favoritos con el personaje/planeta/vehiculo en una sola query
+    #devuelve (None, []) si el usuario no existe
+    favorite = favorites_union()
+    target_models = [model for model, favorite_model, column in FAVORITE_KINDS.values()]
+
+    query = db.session.query(User, favorite.c.id, favorite.c.kind, *target_models) \
+        .select_from(User) \
+        .outerjoin(favorite, favorite.c.user_id == User.id)
+    for kind, (model, favorite_model, column) in FAVORITE_KINDS.items():
+        query = query.outerjoin(model, and_(favorite.c.kind == kind, model.id == favorite.c.target_id))
+    rows = query.filter(User.id == user_id).order_by(favorite.c.position, favorite.c.id).all()
+
+    if not rows:
+        return None, []
+    user = rows[0][0]
+    user_data = user.serialize()
+    favorites = []
+    for row in rows:
+        favorite_id, kind = row[1], row[2]
+        if favorite_id is None: #usuario sin favoritos
+            continue
+        model, favorite_model, column = FAVORITE_KINDS[kind]
+        target = row[3 + list(FAVORITE_KINDS).index(kind)]
+        favorites.append(favorite_model.serialize_parts(favorite_id, user_data, target.serialize()))
+    return user, favorites
+
+def load_favorites_snapshot(user_id):
+    #una sola query por primary key: (favorites_version, version del snapshot, documento)
+    #devuelve None si el usuario no existe; version/documento son None si no hay snapshot
+    return db.session.query(User.favorites_version, FavoritesSnapshot.version, FavoritesSnapshot.document) \
+        .outerjoin(FavoritesSnapshot, FavoritesSnapshot.user_id == User.id) \
+        .filter(User.id == user_id).first()
+
+def save_favorites_snapshot(user_id, version, favorites):
+    #guarda el documento solo si es mas nuevo que el que hay (otro request pudo ganar la carrera); devuelve el json
+    document = json.dumps(favorites)
+    table = FavoritesSnapshot.__table__
+    result = db.session.execute(table.update()
+        .where(table.c.user_id == user_id, table.c.version < version)
+        .values(version=version, document=document, updated_at=datetime.utcnow()))
+    if result.rowcount == 0:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert().values(user_id=user_id, version=version, document=document, updated_at=datetime.utcnow()))
+        except IntegrityError:
+            pass #ya hay un snapshot igual o mas nuevo
+    db.session.commit()
+    return document
+
+def record_changes(entity, action, entity_ids, data=None, user_id=None):
+    #agrega al change_log sin hacer commit: entra en la transaccion de la escritura que lo llama
+    #data: dict con el estado nuevo (o None), igual para todas las filas
+    data = json.dumps(data) if data is not None else None
+    now = datetime.utcnow()
+    rows = [{"entity": entity, "entity_id": entity_id, "action": action, "user_id": user_id, "data": data, "created_at": now}
+        for entity_id in entity_ids]
+    if rows:
+        db.session.execute(ChangeLog.__table__.insert(), rows)
+
+def record_row_changes(entity, changes, user_id=None):
+    #como record_changes pero cada fila con su accion y su estado nuevo: changes = [(accion, dict con id), ...]
+    now = datetime.utcnow()
+    rows = [{"entity": entity, "entity_id": data["id"], "action": action, "user_id": user_id, "data": json.dumps(data), "created_at": now}
+        for action, data in changes]
+    if rows:
+        db.session.execute(ChangeLog.__table__.insert(), rows)
+
+def record_favorite_changes(entity, action, pairs):
+    #como record_changes pero con un usuario por fila: pairs = [(user_id, id del favorito), ...]
+    now = datetime.utcnow()
+    rows = [{"entity": entity, "entity_id": entity_id, "action": action, "user_id": user_id, "data": None, "created_at": now}
+        for user_id, entity_id in pairs]
+    if rows:
+        db.session.execute(ChangeLog.__table__.insert(), rows)
+
+def record_change(model, row_id, action, data=None):
+    record_changes(model.__tablename__, action, [row_id], data=data)
+
+def touch_user_favorites(user_id):
+    #invalida el ETag de /favorites de un usuario; va en la misma transaccion que el cambio
+    #updated_at=updated_at: el onupdate cambiaria el Last-Modified del usuario sin cambiar su ETag
+    db.session.execute(User.__table__.update().where(User.id == user_id)
+        .values(favorites_version=User.favorites_version + 1, updated_at=User.updated_at))
+
+def touch_favorites_of(model, id):
+    #un personaje/planeta/vehiculo cambio: sube la version de todos los usuarios que lo tienen de favorito
+    touch_favorites_where(model, model.id == id)
+
+def touch_favorites_where(model, condition):
+    #igual que touch_favorites_of para todas las filas de model que cumplen condition (ej. name IN (...))
+    for kind, (target_model, favorite_model, column) in FAVORITE_KINDS.items():
+        if target_model is model:
+            user_ids = select(favorite_model.user_id) \
+                .join(model, model.id == getattr(favorite_model, column)) \
+                .where(condition)
+            db.session.execute(User.__table__.update().where(User.id.in_(user_ids))
+                .values(favorites_version=User.favorites_version + 1, updated_at=User.updated_at))
+
+def count_favorites(model, ids, amount):
+    #suma (o resta) amount al favorite_count de varios personajes/planetas/vehiculos
+    #sin tocar updated_at: la fila no cambio para la API (ETag, Last-Modified, el catch_up de /search)
+    db.session.execute(model.__table__.update().where(model.id.in_(ids))
+        .values(favorite_count=model.favorite_count + amount, updated_at=model.updated_at))
+
+def delete_favorites_of(model, id):
+    #antes de borrar un personaje/planeta/vehiculo: borra sus favoritos en la misma transaccion
+    #(su favorite_count se va con la fila, no hace falta restarlo)
+    for kind, (target_model, favorite_model, column) in FAVORITE_KINDS.items():
+        if target_model is model:
+            condition = getattr(favorite_model, column) == id
+            user_ids = [user_id for (user_id,) in db.session.query(favorite_model.user_id).filter(condition)]
+            if not user_ids:
+                continue
+            touch_favorites_of(model, id)
+            record_favorite_changes(favorite_model.__tablename__, 'deleted', [(user_id, id) for user_id in user_ids])
+            favorite_model.query.filter(condition).delete(synchronize_session='fetch')
+
+def delete_user_favorites(user_id):
+    #antes de borrar un usuario: borra sus favoritos y resta 1 al favorite_count de cada uno
+    for kind, (target_model, favorite_model, column) in FAVORITE_KINDS.items():
+        ids = [id for (id,) in db.session.query(getattr(favorite_model, column)).filter(favorite_model.user_id == user_id)]
+        if not ids:
+            continue
+        count_favorites(target_model, ids, -1)
+        record_changes(favorite_model.__tablename__, 'deleted', ids, user_id=user_id)
+        favorite_model.query.filter(favorite_model.user_id == user_id).delete(synchronize_session='fetch')
+    touch_user_favorites(user_id)
+
+def rebuild_favorite_counts():
+    #recalcula todos los favorite_count contando las tablas de favoritos
+    for kind, (model, favorite_model, column) in FAVORITE_KINDS.items():
+        count = select(db.func.count(favorite_model.id)).where(getattr(favorite_model, column) == model.id).scalar_subquery()
+        db.session.execute(model.__table__.update().values(favorite_count=count, updated_at=model.updated_at))
+    db.session.commit()
@@ -0,0 +1,75 @@
+import os
+import sys
+import hmac
+import base64
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+#parametros de scrypt: si cambian, las contraseñas se vuelven a hashear en el siguiente login
+SCRYPT_N = int(os.getenv('PASSWORD_SCRYPT_N', 2 ** 14))
+SCRYPT_R = int(os.getenv('PASSWORD_SCRYPT_R', 8))
+SCRYPT_P = int(os.getenv('PASSWORD_SCRYPT_P', 1))
+
+#pocos threads por worker: un pico de logins no se come toda la CPU; lo que no entra en la cola se rechaza
+HASH_THREADS = int(os.getenv('PASSWORD_HASH_THREADS', 2))
+HASH_QUEUE = int(os.getenv('PASSWORD_HASH_QUEUE', 8))
+_executor = ThreadPoolExecutor(max_workers=HASH_THREADS, thread_name_prefix='password-hash')
+_slots = threading.BoundedSemaphore(HASH_THREADS + HASH_QUEUE)
+_gevent_pool = None
+
+class HashingBusy(Exception):
+    pass
+
+def _scrypt(password, salt, n, r, p):
+    maxmem = 128 * r * (n + p + 2) + 1024 * 1024
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p, maxmem=maxmem, dklen=32)
+
+def _hash(password):
+    salt = os.urandom(16)
+    digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return 'scrypt$%s$%s$%s$%s$%s' % (SCRYPT_N, SCRYPT_R, SCRYPT_P,
+        base64.b64encode(salt).decode(), base64.b64encode(digest).decode())
+
+def _verify(stored, password):
+    #devuelve (coincide, hay que volver a hashear)
+    if not stored.startswith('scrypt$'):
+        #usuarios viejos con la contraseña en texto plano
+        return hmac.compare_digest(stored.encode('utf-8'), password.encode('utf-8')), True
+    algorithm, n, r, p, salt, digest = stored.split('$')
+    n, r, p = int(n), int(r), int(p)
+    expected = _scrypt(password, base64.b64decode(salt), n, r, p)
+    matches = hmac.compare_digest(expected, base64.b64decode(digest))
+    return matches, (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+def _threading_patched():
+    if 'gevent' not in sys.modules:
+        return False
+    from gevent import monkey
+    return monkey.is_module_patched('threading')
+
+def _submit(function, *args):
+    #con workers gevent threading esta parcheado: los threads del executor serian greenlets y scrypt
+    #frenaria todo el loop. El ThreadPool de gevent usa threads reales y solo espera el greenlet del login
+    global _gevent_pool
+    if _threading_patched():
+        if _gevent_pool is None: #se crea en el worker, despues del fork, con el hub de ese proceso
+            from gevent.threadpool import ThreadPool
+            _gevent_pool = ThreadPool(HASH_THREADS)
+        return _gevent_pool.spawn(function, *args).get()
+    #sync/gthread: el thread del request espera, pero nunca hay mas de HASH_THREADS hashes a la vez
+    return _executor.submit(function, *args).result()
+
+def _run(function, *args):
+    if not _slots.acquire(blocking=False):
+        raise HashingBusy()
+    try:
+        return _submit(function, *args)
+    finally:
+        _slots.release()
+
+def hash_password(password):
+    return _run(_hash, password)
+
+def verify_password(stored, password):
+    return _run(_verify, stored, password)
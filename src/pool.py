@@ -0,0 +1,77 @@
+import os
+import time
+import threading
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+class InstrumentedQueuePool(QueuePool):
+    #QueuePool normal que ademas cuenta cuanto se espera por una conexion y cuantas se invalidan
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.connects = 0
+        self.invalidations = 0
+        event.listen(self, 'connect', self._on_connect)
+        event.listen(self, 'invalidate', self._on_invalidate)
+
+    def connect(self):
+        start = time.perf_counter()
+        connection = super().connect()
+        waited = time.perf_counter() - start
+        with self._stats_lock:
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        return connection
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._stats_lock:
+            self.connects += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._stats_lock:
+            self.invalidations += 1
+
+    def stats(self):
+        return {
+            "pid": os.getpid(), #cada worker de gunicorn tiene su propio pool
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "checked_in": self.checkedin(),
+            "overflow": self.overflow(),
+            "checkouts": self.checkouts,
+            "connects": self.connects,
+            "invalidations": self.invalidations,
+            "wait_seconds_total": round(self.wait_seconds_total, 6),
+            "wait_seconds_max": round(self.wait_seconds_max, 6)
+        }
+
+def engine_options_from_env(db_url):
+    #SQLALCHEMY_ENGINE_OPTIONS a partir de variables de entorno, ver .env.example
+    if db_url.startswith('sqlite') and (':memory:' in db_url or db_url.rstrip('/') == 'sqlite:'):
+        return {} #sqlite en memoria necesita su pool propio (una sola conexion)
+
+    options = {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": int(os.getenv('DB_POOL_SIZE', 5)),
+        "max_overflow": int(os.getenv('DB_MAX_OVERFLOW', 10)),
+        "pool_timeout": float(os.getenv('DB_POOL_TIMEOUT', 30)),
+        "pool_recycle": int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        "pool_pre_ping": os.getenv('DB_POOL_PRE_PING', '1').lower() in ('1', 'true', 'yes')
+    }
+    if db_url.startswith('sqlite'):
+        #las conexiones del pool pasan de un thread a otro
+        options["connect_args"] = {"check_same_thread": False}
+    statement_timeout = os.getenv('DB_STATEMENT_TIMEOUT_MS')
+    if statement_timeout and db_url.startswith('postgresql'):
+        options["connect_args"] = {"options": "-c statement_timeout=%d" % int(statement_timeout)}
+    return options
+
+def pool_stats(engine):
+    pool = engine.pool
+    if isinstance(pool, InstrumentedQueuePool):
+        return pool.stats()
+    return {"pid": os.getpid(), "pool": type(pool).__name__, "status": pool.status()}
@@ -0,0 +1,38 @@
+import os
+import time
+import threading
+from models import db, FAVORITE_KINDS
+
+class PopularityBoard:
+    #top de cada tipo guardado en memoria, se vuelve a leer de la base cada refresh_seconds
+    def __init__(self, size=100, refresh_seconds=60):
+        self.size = size
+        self.refresh_seconds = refresh_seconds
+        self._boards = {} #tipo -> (momento de carga, filas)
+        self._lock = threading.Lock()
+
+    def top(self, kind, limit):
+        loaded = self._boards.get(kind)
+        if loaded is None or time.monotonic() - loaded[0] > self.refresh_seconds:
+            loaded = (time.monotonic(), self._load(kind))
+            with self._lock:
+                self._boards[kind] = loaded
+        return loaded[1][:limit]
+
+    def _load(self, kind):
+        model = FAVORITE_KINDS[kind][0]
+        rows = db.session.query(model.id, model.name, model.favorite_count) \
+            .filter(model.favorite_count > 0) \
+            .order_by(model.favorite_count.desc(), model.id) \
+            .limit(self.size)
+        return [{"id": id, "name": name, "favorite_count": count} for id, name, count in rows]
+
+    def clear(self):
+        with self._lock:
+            self._boards = {}
+
+def board_from_env():
+    return PopularityBoard(
+        size=int(os.getenv('POPULAR_TOP_SIZE', 100)),
+        refresh_seconds=int(os.getenv('POPULAR_REFRESH_SECONDS', 60))
+    )
@@ -0,0 +1,167 @@
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+from flask import g, request
+from metrics import Counter, REGISTRY
+from utils import APIException
+
+#presupuesto por endpoint: (tokens por segundo, rafaga maxima); el resto usa RATE_LIMIT_DEFAULT
+ROUTE_BUDGETS = {
+    'login': (0.5, 5), #cada login es un hash scrypt
+    'register_user': (0.2, 3),
+    'handle_hello': (1, 5), #/user devuelve todos los usuarios
+    'add_favorite_people': (5, 20),
+    'add_favorite_planet': (5, 20),
+    'add_favorite_vehicle': (5, 20),
+    'bulk_favorites': (1, 5),
+    'export_entity': (0.1, 2),
+    'import_entity': (0.1, 2),
+    'search': (5, 20)
+}
+#nunca se limitan (/metrics lo lee prometheus); las vistas del admin (endpoints con '.') tampoco
+EXEMPT_ENDPOINTS = ('metrics', 'static')
+#long-polls y streams SSE: pagan su presupuesto pero no ocupan lugar en max_concurrent, casi todo el
+#tiempo esperan sin conexion a la base y con un lugar tomado hasta el teardown dejarian al worker sin cupo
+UNADMITTED_ENDPOINTS = ('list_changes',)
+
+RATE_LIMIT_DECISIONS = Counter('rate_limit_decisions_total', 'Rate limiter and admission control decisions by endpoint')
+
+class MemoryBucketStore:
+    #token buckets en memoria del proceso (cada worker de gunicorn cuenta por su lado)
+    #clock se puede reemplazar para probarlo sin esperar
+    def __init__(self, max_keys=100000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets = OrderedDict() #key -> (tokens, ultima vez)
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1):
+        #devuelve (permitido, segundos hasta que alcance)
+        with self._lock:
+            now = self.clock()
+            tokens, last = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            #se descarta el que hace mas que no pide: su bucket ya estaria lleno de nuevo
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, 0 if allowed else (cost - tokens) / rate
+
+#el mismo algoritmo atomico dentro de redis, para compartir los buckets entre workers
+TAKE_SCRIPT = """
+local rate, burst, now, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'last')
+local tokens = tonumber(bucket[1]) or burst
+local last = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - last) * rate)
+local allowed = tokens >= cost
+if allowed then tokens = tokens - cost end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'last', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+if allowed then return {1, '0'} end
+return {0, tostring((cost - tokens) / rate)}
+"""
+
+class RedisBucketStore:
+    #client puede ser redis.Redis o cualquier objeto con eval(script, numkeys, *keys_and_args)
+    def __init__(self, client, prefix='swapi:ratelimit:', clock=time.time):
+        self.client = client
+        self.prefix = prefix
+        self.clock = clock
+
+    def take(self, key, rate, burst, cost=1):
+        allowed, retry_after = self.client.eval(TAKE_SCRIPT, 1, self.prefix + key, rate, burst, self.clock(), cost)
+        return bool(int(allowed)), float(retry_after)
+
+def parse_budget(text):
+    #"5:20" -> 5 por segundo con rafaga de 20
+    rate, burst = text.split(':')
+    return float(rate), float(burst)
+
+class RateLimiter:
+    def __init__(self, store, default_budget=(20, 40), budgets=None, max_concurrent=0):
+        self.store = store
+        self.default_budget = default_budget
+        self.budgets = dict(ROUTE_BUDGETS if budgets is None else budgets)
+        #requests a la vez por worker (0 = sin limite); se corta antes de quedarse sin conexiones del pool
+        self.max_concurrent = max_concurrent
+        self._slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def admit(self, endpoint):
+        if self._slots is None:
+            return
+        if not self._slots.acquire(blocking=False):
+            RATE_LIMIT_DECISIONS.inc((('endpoint', endpoint), ('decision', 'shed')))
+            raise APIException('Server busy, try again', status_code=503, headers={'Retry-After': '1'})
+        with self._lock:
+            self.in_flight += 1
+        g.rate_limit_slot = True
+
+    def release(self):
+        if g.pop('rate_limit_slot', False):
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def check(self, endpoint, client):
+        rate, burst = self.budgets.get(endpoint, self.default_budget)
+        allowed, retry_after = self.store.take('%s:%s' % (endpoint, client), rate, burst)
+        if not allowed:
+            RATE_LIMIT_DECISIONS.inc((('endpoint', endpoint), ('decision', 'limited')))
+            raise APIException('Too many requests, slow down', status_code=429,
+                headers={'Retry-After': str(max(1, math.ceil(retry_after)))})
+        RATE_LIMIT_DECISIONS.inc((('endpoint', endpoint), ('decision', 'allowed')))
+
+    def render(self):
+        #para /metrics (se registra en REGISTRY)
+        return ['# HELP http_requests_in_flight Requests being served by this worker',
+                '# TYPE http_requests_in_flight gauge',
+                'http_requests_in_flight %s' % self.in_flight,
+                'http_requests_max_concurrent %s' % self.max_concurrent]
+
+def limiter_from_env(default_max_concurrent=0):
+    store = MemoryBucketStore(max_keys=int(os.getenv('RATE_LIMIT_MAX_KEYS', 100000)))
+    if os.getenv('RATE_LIMIT_STORE', 'memory') == 'redis':
+        import redis #solo se necesita con RATE_LIMIT_STORE=redis
+        store = RedisBucketStore(redis.Redis.from_url(os.getenv('CACHE_REDIS_URL', 'redis://localhost:6379/0')))
+    budgets = dict(ROUTE_BUDGETS)
+    #RATE_LIMIT_ROUTES=login=1:5,search=10:30
+    for item in filter(None, os.getenv('RATE_LIMIT_ROUTES', '').split(',')):
+        endpoint, budget = item.split('=')
+        budgets[endpoint.strip()] = parse_budget(budget)
+    return RateLimiter(
+        store,
+        default_budget=parse_budget(os.getenv('RATE_LIMIT_DEFAULT', '20:40')),
+        budgets=budgets,
+        max_concurrent=int(os.getenv('MAX_CONCURRENT_REQUESTS', default_max_concurrent))
+    )
+
+def setup_rate_limits(app, client_key, default_max_concurrent=0):
+    #client_key: funcion que devuelve a quien se le cobra el request (usuario del token o IP)
+    if os.getenv('RATE_LIMIT_ENABLED', '1').lower() not in ('1', 'true', 'yes'):
+        return None
+    limiter = limiter_from_env(default_max_concurrent)
+    REGISTRY.extend([RATE_LIMIT_DECISIONS, limiter])
+
+    @app.before_request
+    def limit_request():
+        endpoint = request.endpoint or 'unknown'
+        if endpoint in EXEMPT_ENDPOINTS or '.' in endpoint:
+            return
+        #primero el presupuesto del cliente: un cliente limitado no ocupa lugar
+        limiter.check(endpoint, client_key())
+        if endpoint not in UNADMITTED_ENDPOINTS:
+            limiter.admit(endpoint)
+
+    @app.teardown_request
+    def release_request(exception):
+        limiter.release()
+
+    return limiter
@@ -0,0 +1,95 @@
+import os
+import time
+import threading
+from functools import wraps
+from flask import g, has_request_context, current_app
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql.dml import UpdateBase
+
+class ReplicaRouter:
+    #elige replica en round-robin; una replica que falla queda afuera eject_seconds segundos
+    def __init__(self):
+        self.keys = []
+        self.eject_seconds = 30
+        self.max_lag_seconds = 5 #cuanto puede tardar una replica en ver un commit del primario
+        self._next = 0
+        self._ejected_until = {}
+        self._lock = threading.Lock()
+
+    def choose(self):
+        now = time.monotonic()
+        with self._lock:
+            for _ in range(len(self.keys)):
+                key = self.keys[self._next % len(self.keys)]
+                self._next += 1
+                if self._ejected_until.get(key, 0) <= now:
+                    return key
+        return None #todas caidas: se lee del primario
+
+    def eject(self, key):
+        with self._lock:
+            self._ejected_until[key] = time.monotonic() + self.eject_seconds
+
+    def stats(self):
+        now = time.monotonic()
+        return {key: {"healthy": self._ejected_until.get(key, 0) <= now} for key in self.keys}
+
+router = ReplicaRouter()
+
+class RoutingSession(Session):
+    #en endpoints marcados con @read_only las lecturas van a una replica;
+    #cualquier escritura (y todo lo que se lea despues en ese request) va al primario
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context() and g.get('read_only'):
+            if self._flushing or isinstance(clause, UpdateBase):
+                g.wrote = True
+            elif not g.get('wrote'):
+                if 'replica_key' not in g:
+                    g.replica_key = router.choose() #la misma replica durante todo el request
+                if g.replica_key is not None:
+                    return self._db.engines[g.replica_key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def reading_replica():
+    #True si lo ultimo que leyo este request salio de una replica (puede estar atrasada)
+    return has_request_context() and g.get('replica_key') is not None and not g.get('wrote')
+
+def read_only(view):
+    #si se pierde la conexion con la replica, se la saca de la rotacion y se repite el request en el primario
+    #otros errores (ej. statement_timeout) no son culpa de la replica; si el request ya escribio, el error vino del primario
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not router.keys:
+            return view(*args, **kwargs)
+        g.read_only = True
+        try:
+            return view(*args, **kwargs)
+        except OperationalError as error:
+            key = g.pop('replica_key', None)
+            if key is None or g.get('wrote') or not error.connection_invalidated:
+                raise
+            router.eject(key)
+            current_app.extensions['sqlalchemy'].session.rollback()
+            g.read_only = False
+            return view(*args, **kwargs)
+    return wrapper
+
+def setup_replicas(app):
+    #DATABASE_REPLICA_URLS=postgresql://replica1/db,postgresql://replica2/db (antes de db.init_app)
+    urls = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+    for number, url in enumerate(urls):
+        binds['replica_%s' % number] = url.replace("postgres://", "postgresql://")
+    router.keys = sorted(key for key in binds if key.startswith('replica_'))
+    router.eject_seconds = int(os.getenv('REPLICA_EJECT_SECONDS', 30))
+    router.max_lag_seconds = float(os.getenv('REPLICA_MAX_LAG_SECONDS', 5))
+
+def watch_replica_health(db):
+    #errores de conexion con una replica la sacan de la rotacion (llamar con app context)
+    for key in router.keys:
+        def on_error(context, key=key):
+            if context.is_disconnect or context.connection is None:
+                router.eject(key)
+        event.listen(db.engines[key], 'handle_error', on_error)
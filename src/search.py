@@ -0,0 +1,265 @@
+import os
+import re
+import time
+import heapq
+import bisect
+import difflib
+import logging
+import threading
+from itertools import islice
+from flask import current_app
+from models import db, People, Planet, Vehicle
+from utils import APIException
+
+#tipo -> (modelo, {columna: peso}); el nombre pesa mas que los otros atributos
+SEARCH_FIELDS = {
+    'people': (People, {'name': 3}),
+    'planet': (Planet, {'name': 3, 'climate': 1, 'terrain': 1}),
+    'vehicle': (Vehicle, {'name': 3, 'model': 2, 'manufacturer': 1})
+}
+MAX_PREFIX_TOKENS = 200 #cuantas palabras puede abarcar un prefijo corto como "a"
+FUZZY_WINDOW = 500
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+#cada cuanto se compara el indice con la base (otros workers/imports pueden haber cambiado filas)
+SEARCH_CHECK_SECONDS = float(os.getenv('SEARCH_CHECK_SECONDS', 5))
+#cuanto espera una busqueda a que termine el primer armado antes de contestar 503
+SEARCH_BUILD_WAIT = float(os.getenv('SEARCH_BUILD_WAIT', 10))
+#cuantas entradas se puntuan como maximo por busqueda: una palabra que esta en casi todas las filas
+#("arid", "bench") se puntua sobre una muestra y el total se estima
+SEARCH_MAX_POSTINGS = int(os.getenv('SEARCH_MAX_POSTINGS', 5000))
+EMPTY = {}
+
+logger = logging.getLogger(__name__)
+
+def tokenize(text):
+    return TOKEN_RE.findall(str(text).lower())
+
+def generation(model):
+    #(filas, ultimo updated_at): cambia con cada alta, baja o edicion, hecha desde cualquier worker
+    return db.session.query(db.func.count(model.id), db.func.max(model.updated_at)).one()
+
+class SearchIndex:
+    #indice invertido en memoria (uno por worker): palabra -> {tipo: {id: peso}}
+    #se arma en un thread aparte (al arrancar el worker o con la primera busqueda) y se actualiza fila por fila;
+    #cada SEARCH_CHECK_SECONDS un thread compara generation() con la base y trae lo que cambio en otros workers
+    def __init__(self, check_seconds=SEARCH_CHECK_SECONDS, max_postings=SEARCH_MAX_POSTINGS):
+        self.check_seconds = check_seconds
+        self.max_postings = max_postings
+        self._lock = threading.RLock()
+        self._ready = threading.Event()
+        self._worker = None
+        self._stale = False
+        self._checked_at = 0
+        self._postings = {}
+        self._docs = {kind: {} for kind in SEARCH_FIELDS} #tipo -> {id: (nombre, palabras)}
+        self._vocabulary = [] #palabras ordenadas, para buscar prefijos con bisect
+        self._seen = {} #tipo -> ultimo updated_at leido
+
+    @property
+    def _built(self):
+        return self._ready.is_set()
+
+    def start(self, app):
+        #arma (o pone al dia) el indice en background, sin frenar requests; devuelve el thread
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return self._worker
+            self._checked_at = time.monotonic()
+            self._worker = threading.Thread(target=self._update, args=(app,), name='search-index', daemon=True)
+            self._worker.start()
+            return self._worker
+
+    def _update(self, app):
+        try:
+            with app.app_context():
+                if self._stale or not self._built:
+                    self.build()
+                else:
+                    self.catch_up()
+                db.session.remove()
+        except Exception:
+            logger.exception('Could not build the search index')
+
+    def build(self):
+        #se arma aparte y se cambia de una vez: mientras tanto las busquedas usan el indice anterior
+        self._stale = False
+        seen = {}
+        postings, docs = {}, {kind: {} for kind in SEARCH_FIELDS}
+        for kind, (model, fields) in SEARCH_FIELDS.items():
+            seen[kind] = generation(model)[1] #antes de leer: lo que cambie durante el armado se trae despues
+            columns = ['id'] + list(fields)
+            query = db.session.query(*[getattr(model, column) for column in columns]).yield_per(5000)
+            for row in query:
+                self._add(kind, row[0], dict(zip(columns[1:], row[1:])), postings, docs)
+        db.session.rollback()
+        with self._lock:
+            self._postings, self._docs, self._seen = postings, docs, seen
+            self._vocabulary = sorted(postings)
+        self._ready.set()
+
+    def catch_up(self):
+        #vuelve a leer las filas con updated_at nuevo; si cambio la cantidad (bajas en otro worker) se rearma todo
+        for kind, (model, fields) in SEARCH_FIELDS.items():
+            count, last = generation(model)
+            if last is not None and (self._seen.get(kind) is None or last > self._seen[kind]):
+                columns = ['id'] + list(fields)
+                query = db.session.query(*[getattr(model, column) for column in columns])
+                if self._seen.get(kind) is not None:
+                    query = query.filter(model.updated_at >= self._seen[kind])
+                rows = query.all()
+                with self._lock:
+                    for row in rows:
+                        self._replace(kind, row[0], dict(zip(columns[1:], row[1:])))
+                    self._seen[kind] = last
+            if len(self._docs[kind]) != count:
+                db.session.rollback()
+                return self.build()
+        db.session.rollback()
+
+    def reset(self):
+        #despues de un import: el proximo chequeo rearma todo, mientras tanto se sigue usando el indice actual
+        self._stale = True
+        self._checked_at = 0
+
+    def refresh(self, model, id):
+        #vuelve a leer una fila despues de editarla o borrarla
+        kind = next((kind for kind, (search_model, fields) in SEARCH_FIELDS.items() if search_model is model), None)
+        if kind is None or not self._built:
+            return
+        model, fields = SEARCH_FIELDS[kind]
+        row = db.session.query(*[getattr(model, column) for column in fields]).filter(model.id == id).first()
+        with self._lock:
+            self._replace(kind, id, dict(zip(fields, row)) if row is not None else None)
+
+    def _replace(self, kind, id, values):
+        #values None = la fila ya no existe
+        self._remove(kind, id)
+        if values is not None:
+            for token in self._add(kind, id, values, self._postings, self._docs):
+                position = bisect.bisect_left(self._vocabulary, token)
+                if position == len(self._vocabulary) or self._vocabulary[position] != token: #palabra nueva
+                    self._vocabulary.insert(position, token)
+
+    def _add(self, kind, id, values, postings_by_token, docs):
+        fields = SEARCH_FIELDS[kind][1]
+        tokens = set()
+        for column, weight in fields.items():
+            for token in tokenize(values[column]):
+                postings = postings_by_token.setdefault(token, {}).setdefault(kind, {})
+                postings[id] = max(postings.get(id, 0), weight)
+                tokens.add(token)
+        docs[kind][id] = (values['name'], tokens)
+        return tokens
+
+    def _remove(self, kind, id):
+        doc = self._docs[kind].pop(id, None)
+        if doc is None:
+            return
+        for token in doc[1]:
+            by_kind = self._postings.get(token)
+            if by_kind is None or kind not in by_kind:
+                continue
+            by_kind[kind].pop(id, None)
+            if not by_kind[kind]:
+                del by_kind[kind]
+            if not by_kind:
+                del self._postings[token]
+                position = bisect.bisect_left(self._vocabulary, token)
+                if position < len(self._vocabulary) and self._vocabulary[position] == token:
+                    del self._vocabulary[position]
+
+    def _expand(self, token):
+        #palabras del indice que coinciden con token: exacta (x3), prefijo (x2) o parecida (x1)
+        matches = {}
+        if token in self._postings:
+            matches[token] = 3
+        start = bisect.bisect_left(self._vocabulary, token)
+        for candidate in self._vocabulary[start:start + MAX_PREFIX_TOKENS]:
+            if not candidate.startswith(token):
+                break
+            matches.setdefault(candidate, 2)
+        if not matches and len(token) > 2:
+            #fuzzy solo entre las palabras vecinas en orden alfabetico y de largo parecido,
+            #asi el costo no depende del tamaño del indice (un error de tipeo casi siempre conserva el principio)
+            neighbours = self._vocabulary[max(0, start - FUZZY_WINDOW):start + FUZZY_WINDOW]
+            neighbours = [candidate for candidate in neighbours if abs(len(candidate) - len(token)) <= 2]
+            for candidate in difflib.get_close_matches(token, neighbours, n=5, cutoff=0.75):
+                matches[candidate] = 1
+        return matches
+
+    def search(self, text, kinds=None, limit=20, offset=0):
+        #devuelve (total, pagina); con palabras muy comunes el total es una estimacion
+        if not self._built or time.monotonic() - self._checked_at >= self.check_seconds:
+            self.start(current_app._get_current_object())
+        if not self._ready.wait(SEARCH_BUILD_WAIT):
+            raise APIException('Search index is still loading, try again', status_code=503, headers={'Retry-After': '2'})
+        tokens = list(dict.fromkeys(tokenize(text)))
+        if not tokens:
+            return 0, []
+        kinds = kinds or list(SEARCH_FIELDS)
+
+        #bajo el lock solo se copia una parte acotada del indice: las palabras que coinciden con cada termino
+        #y a lo sumo max_postings entradas del termino mas raro; el resto se calcula afuera, sin frenar
+        #a otras busquedas ni a refresh()
+        with self._lock:
+            terms = []
+            for token in tokens:
+                matches = sorted(self._expand(token).items(), key=lambda item: -item[1])
+                candidates = [(self._postings[candidate], match_weight) for candidate, match_weight in matches]
+                size = sum(len(by_kind.get(kind, ())) for by_kind, match_weight in candidates for kind in kinds)
+                if not size:
+                    return 0, []
+                terms.append((size, candidates))
+            terms.sort(key=lambda term: term[0])
+            available, rarest = terms[0]
+            sample = []
+            budget = self.max_postings
+            for by_kind, match_weight in rarest:
+                for kind in kinds:
+                    if budget <= 0:
+                        break
+                    postings = by_kind.get(kind)
+                    if postings:
+                        items = list(islice(postings.items(), budget))
+                        budget -= len(items)
+                        sample.append((kind, match_weight, items))
+        scanned = self.max_postings - budget
+
+        scores = {}
+        for kind, match_weight, items in sample:
+            for id, field_weight in items:
+                key = (kind, id)
+                score = match_weight * field_weight
+                if score > scores.get(key, 0):
+                    scores[key] = score
+        #los otros terminos solo se consultan para las filas que ya coinciden (dict.get no necesita el lock)
+        for size, candidates in terms[1:]:
+            matched = {}
+            for key, score in scores.items():
+                kind, id = key
+                best = 0
+                for by_kind, match_weight in candidates:
+                    field_weight = by_kind.get(kind, EMPTY).get(id)
+                    if field_weight and match_weight * field_weight > best:
+                        best = match_weight * field_weight
+                if best:
+                    matched[key] = score + best
+            scores = matched
+            if not scores:
+                return 0, []
+
+        total = len(scores)
+        if available > scanned:
+            total = int(round(total * available / scanned)) #se vio solo una muestra: se extrapola
+        docs = self._docs
+        def rank(item):
+            (kind, id), score = item
+            doc = docs[kind].get(id)
+            return -score, doc[0] if doc is not None else ''
+        page = heapq.nsmallest(offset + limit, scores.items(), key=rank)[offset:]
+        results = []
+        for (kind, id), score in page:
+            doc = docs[kind].get(id)
+            if doc is not None: #borrada mientras se buscaba
+                results.append({"type": kind, "id": id, "name": doc[0], "score": score})
+        return total, results
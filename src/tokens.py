@@ -0,0 +1,81 @@
+import os
+import time
+from flask import request
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from sqlalchemy import event, inspect
+from cache import LRUCache, RedisCache
+from utils import APIException
+from models import User
+
+class TokenAuth:
+    #tokens firmados con HMAC que llevan el id y is_active del usuario
+    #verificarlos no toca la base; los usuarios desactivados o borrados quedan en revocations
+    def __init__(self, secret, max_age=3600, revocations=None):
+        #sin secreto no se emiten ni se aceptan tokens (una clave conocida dejaria falsificarlos)
+        self.serializer = URLSafeTimedSerializer(secret, salt='swapi-token') if secret else None
+        self.max_age = max_age
+        #user_id -> momento de la revocacion; alcanza con guardarlo max_age, despues todo token anterior ya vencio
+        self.revocations = revocations if revocations is not None else LRUCache(max_entries=100000, ttl=max_age)
+
+    def _require_secret(self):
+        if self.serializer is None:
+            raise APIException('Token authentication is not configured (set TOKEN_SECRET)', status_code=503)
+
+    def issue(self, user):
+        self._require_secret()
+        return self.serializer.dumps({"uid": user.id, "act": bool(user.is_active)})
+
+    def revoke(self, user_id):
+        self.revocations.set(str(user_id), time.time())
+
+    def verify(self, token):
+        #devuelve el user_id del token o levanta APIException 401/403
+        self._require_secret()
+        try:
+            claims, issued_at = self.serializer.loads(token, max_age=self.max_age, return_timestamp=True)
+        except SignatureExpired:
+            raise APIException('Token expired', status_code=401, headers={'WWW-Authenticate': 'Bearer error="invalid_token"'})
+        except BadSignature:
+            raise APIException('Invalid token', status_code=401, headers={'WWW-Authenticate': 'Bearer error="invalid_token"'})
+        if not claims.get("act"):
+            raise APIException('User is not active', status_code=403)
+        revoked_at = self.revocations.get(str(claims["uid"]))
+        if revoked_at is not None and issued_at.timestamp() <= revoked_at:
+            raise APIException('Token revoked', status_code=403)
+        return claims["uid"]
+
+    def current_user_id(self):
+        #Authorization: Bearer <token>
+        header = request.headers.get('Authorization', '')
+        scheme, _, token = header.partition(' ')
+        if scheme.lower() != 'bearer' or not token:
+            raise APIException('You need to log in (Authorization: Bearer <token>)', status_code=401, headers={'WWW-Authenticate': 'Bearer'})
+        return self.verify(token.strip())
+
+    def watch_users(self):
+        #cualquier desactivacion o borrado de un User (API, admin, scripts) revoca sus tokens
+        @event.listens_for(User, 'after_update')
+        def revoke_deactivated(mapper, connection, target):
+            history = inspect(target).attrs.is_active.history
+            if history.has_changes() and not target.is_active:
+                self.revoke(target.id)
+
+        @event.listens_for(User, 'after_delete')
+        def revoke_deleted(mapper, connection, target):
+            self.revoke(target.id)
+
+def auth_from_env(logger=None):
+    max_age = int(os.getenv('TOKEN_MAX_AGE', 3600))
+    #solo TOKEN_SECRET: FLASK_APP_KEY tiene valores de ejemplo publicos ('sample key', .env.example)
+    secret = os.getenv('TOKEN_SECRET')
+    if not secret and logger is not None:
+        logger.warning('TOKEN_SECRET is not set: /login and the favorites endpoints will answer 503')
+    redis_url = os.getenv('CACHE_REDIS_URL')
+    revocations = None
+    if redis_url:
+        #con varios workers las revocaciones tienen que ser compartidas
+        import redis
+        revocations = RedisCache(redis.Redis.from_url(redis_url), ttl=max_age, prefix='swapi:revoked:')
+    auth = TokenAuth(secret, max_age=max_age, revocations=revocations)
+    auth.watch_users()
+    return auth
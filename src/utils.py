@@ -1,21 +1,86 @@
-from flask import jsonify, url_for
+import io
+import csv
+from flask import jsonify, url_for, json
 
 class APIException(Exception):
     #logra que el error va a ser ignorado... te avisa del error pero el servidor sigue corriendo en el fondo
     status_code = 400
 
-    def __init__(self, message, status_code=None, payload=None):
+    def __init__(self, message, status_code=None, payload=None, headers=None):
         Exception.__init__(self)
         self.message = message
         if status_code is not None:
             self.status_code = status_code
         self.payload = payload
+        self.headers = headers #ej. {'Retry-After': '1'}
 
     def to_dict(self):
         rv = dict(self.payload or ())
         rv['message'] = self.message
         return rv
 
+def parse_fields(text):
+    #"id,people.name,people.id" -> {"id": None, "people": {"name": None, "id": None}}; None = todo
+    if not text:
+        return None
+    tree = {}
+    for path in text.split(','):
+        parts = [part.strip() for part in path.split('.') if part.strip()]
+        if not parts:
+            continue
+        node = tree
+        for part in parts[:-1]:
+            if part in node and node[part] is None: #ya se pidio el objeto entero
+                node = None
+                break
+            node = node.setdefault(part, {})
+        if node is not None:
+            node[parts[-1]] = None
+    return tree or None
+
+def project(data, tree):
+    #deja solo las keys pedidas (sparse fieldset); las que el objeto no tiene se ignoran
+    if tree is None or not isinstance(data, dict):
+        return data
+    return {key: project(data[key], subtree) for key, subtree in tree.items() if key in data}
+
+def keyset_page(query, id_column, after=None, limit=20, max_limit=100):
+    #paginacion por cursor: WHERE id > after ORDER BY id LIMIT n (no usa OFFSET, cada pagina cuesta lo mismo)
+    limit = max(1, min(limit, max_limit))
+    if after is not None:
+        query = query.filter(id_column > after)
+    rows = query.order_by(id_column).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1].id
+    return rows, next_cursor
+
+def ndjson_chunks(columns, rows, batch_size=1000):
+    #un objeto json por linea, se manda de a batch_size filas
+    buffer = []
+    for row in rows:
+        buffer.append(json.dumps(dict(zip(columns, row))))
+        if len(buffer) >= batch_size:
+            yield '\n'.join(buffer) + '\n'
+            buffer = []
+    if buffer:
+        yield '\n'.join(buffer) + '\n'
+
+def csv_chunks(columns, rows, batch_size=1000):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
@@ -0,0 +1,72 @@
+#los tests corren contra dos archivos sqlite temporales (primario y replica), sin servicios externos
+#la app lee la configuracion al importarse: las variables se ponen antes del import
+import os
+import sys
+import tempfile
+import pytest
+from sqlalchemy import event
+
+DIRECTORY = tempfile.mkdtemp(prefix='swapi-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(DIRECTORY, 'primary.db')
+os.environ['DATABASE_REPLICA_URLS'] = 'sqlite:///' + os.path.join(DIRECTORY, 'replica.db')
+os.environ['TOKEN_SECRET'] = 'test-secret'
+os.environ['RATE_LIMIT_ENABLED'] = '0'
+os.environ['PASSWORD_SCRYPT_N'] = '1024' #hashes rapidos
+os.environ['CHANGES_SETTLE_MS'] = '0'
+os.environ.pop('CACHE_REDIS_URL', None)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from app import app as flask_app, entity_cache, token_auth
+from models import db, User, People, Planet, Vehicle
+from replicas import router
+
+REPLICA_KEYS = list(router.keys)
+
+@pytest.fixture
+def app():
+    #base vacia en cada test; las replicas solo se usan en los tests que piden el fixture replica
+    router.keys = []
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+        entity_cache.clear()
+        token_auth.revocations.clear() #los ids se reusan entre tests
+        yield flask_app
+        db.session.remove()
+    router.keys = list(REPLICA_KEYS)
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def queries(app):
+    #sentencias SQL que se ejecutan durante el test (contra el primario)
+    statements = []
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', count)
+    yield statements
+    event.remove(db.engine, 'before_cursor_execute', count)
+
+def add_catalog(size):
+    for number in range(size):
+        db.session.add(People(name='Luke %s' % number, mass=77, height=172, hair_color='blond', skin_color='fair',
+            eye_color='blue', birth_year='19BBY', gender='male'))
+        db.session.add(Planet(name='Tatooine %s' % number, diameter=10465, rotation_period=23, orbital_period=304,
+            gravity=1, population=200000, climate='arid', terrain='desert', surface_water='1'))
+        db.session.add(Vehicle(name='Speeder %s' % number, model='X-34', manufacturer='SoroSuub', cost_in_credits=10550,
+            length=3, crew=1, passengers=1))
+    db.session.commit()
+
+def add_user(email, password='secret'):
+    user = User(email=email, name=email.split('@')[0], password=password, is_active=True)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+def login(client, email, password='secret'):
+    response = client.post('/login', json={"email": email, "password": password})
+    assert response.status_code == 200, response.json
+    return {"Authorization": "Bearer " + response.json["token"]}
@@ -0,0 +1,47 @@
+from models import db, People, FavoritePeople
+from conftest import add_catalog, add_user
+
+def favorite_counts():
+    db.session.expire_all()
+    return [people.favorite_count for people in People.query.order_by(People.id)]
+
+def test_admin_favorites_keep_favorite_count(client):
+    add_catalog(3)
+    user = add_user('fan@example.com')
+
+    response = client.post('/admin/favoritepeople/new/', data={"user": user.id, "people": 1})
+    assert response.status_code == 302
+    assert favorite_counts() == [1, 0, 0]
+    favorite_id = FavoritePeople.query.one().id
+
+    response = client.post('/admin/favoritepeople/edit/?id=%s' % favorite_id, data={"user": user.id, "people": 3})
+    assert response.status_code == 302
+    assert favorite_counts() == [0, 0, 1]
+
+    response = client.post('/admin/favoritepeople/delete/', data={"id": favorite_id})
+    assert response.status_code == 302
+    assert favorite_counts() == [0, 0, 0]
+
+def test_admin_edits_refresh_the_entity_cache(client):
+    add_catalog(1)
+    assert client.get('/get-people/1').json["name"] == 'Luke 0'
+    data = {field: value for field, value in People.query.get(1).serialize().items() if field != 'id'}
+
+    response = client.post('/admin/people/edit/?id=1', data=dict(data, name='Luke Skywalker'))
+    assert response.status_code == 302
+    assert client.get('/get-people/1').json["name"] == 'Luke Skywalker'
+
+    response = client.post('/admin/people/delete/', data={"id": 1})
+    assert response.status_code == 302
+    assert client.get('/get-people/1').status_code == 404
+
+def test_admin_deletes_favorited_rows(client):
+    add_catalog(2)
+    user = add_user('fan@example.com')
+    db.session.add_all([FavoritePeople(user_id=user.id, people_id=1), FavoritePeople(user_id=user.id, people_id=2)])
+    db.session.commit()
+
+    assert client.post('/admin/people/delete/', data={"id": 1}).status_code == 302
+    assert [people.id for people in People.query] == [2]
+    assert client.post('/admin/user/delete/', data={"id": user.id}).status_code == 302
+    assert FavoritePeople.query.count() == 0
@@ -0,0 +1,74 @@
+import fnmatch
+import cache
+from cache import LRUCache, RedisCache
+
+class FakeRedis:
+    #lo minimo de redis.Redis que usa RedisCache
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def setex(self, key, ttl, value):
+        self.data[key] = value.encode('utf-8')
+        self.ttls[key] = ttl
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def scan_iter(self, pattern):
+        return [key for key in list(self.data) if fnmatch.fnmatch(key, pattern)]
+
+def test_lru_cache_evicts_least_recently_used():
+    lru = LRUCache(max_entries=2, ttl=60)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    assert lru.get('a') == 1 #'a' pasa a ser el mas reciente
+    lru.set('c', 3)
+    assert lru.get('b') is None
+    assert lru.get('a') == 1
+    assert lru.get('c') == 3
+    assert lru.stats()["evictions"] == 1
+    assert lru.stats()["size"] == 2
+
+def test_lru_cache_expires_entries(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    lru = LRUCache(ttl=10)
+    lru.set('a', {"name": "Luke"})
+    now[0] += 9
+    assert lru.get('a') == {"name": "Luke"}
+    now[0] += 2
+    assert lru.get('a') is None
+    assert (lru.hits, lru.misses) == (1, 1)
+
+def test_lru_cache_delete_and_clear():
+    lru = LRUCache()
+    lru.set('a', 1)
+    lru.set('b', 2)
+    lru.delete('a')
+    assert lru.get('a') is None
+    lru.clear()
+    assert lru.get('b') is None
+
+def test_redis_cache_round_trips_json_with_prefix_and_ttl():
+    client = FakeRedis()
+    redis_cache = RedisCache(client, ttl=30, prefix='test:')
+    assert redis_cache.get('people:1') is None
+    redis_cache.set('people:1', {"id": 1, "name": "Luke"})
+    assert client.ttls == {'test:people:1': 30}
+    assert redis_cache.get('people:1') == {"id": 1, "name": "Luke"}
+    assert (redis_cache.hits, redis_cache.misses) == (1, 1)
+    redis_cache.delete('people:1')
+    assert redis_cache.get('people:1') is None
+
+def test_redis_cache_clear_only_touches_its_prefix():
+    client = FakeRedis()
+    client.data['other:key'] = b'1'
+    redis_cache = RedisCache(client, prefix='test:')
+    redis_cache.set('a', 1)
+    redis_cache.set('b', 2)
+    redis_cache.clear()
+    assert list(client.data) == ['other:key']
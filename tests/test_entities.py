@@ -0,0 +1,67 @@
+import pytest
+from datetime import datetime
+from sqlalchemy import event
+from models import db, User, People
+from conftest import add_catalog, add_user, login
+
+@pytest.fixture
+def concurrent_write(app):
+    #apenas el request lee la fila, otra conexion (otro worker, un import) la cambia
+    add_catalog(1)
+    db.session.expunge_all() #que el request la vuelva a leer de la base
+    pending = [True]
+    def bump_version(target, context):
+        if not pending:
+            return
+        pending.pop()
+        with db.engine.begin() as connection:
+            connection.execute(People.__table__.update().where(People.id == 1)
+                .values(version=People.version + 1, hair_color='grey'))
+    event.listen(People, 'load', bump_version)
+    yield
+    event.remove(People, 'load', bump_version)
+
+def test_put_racing_another_write_is_a_conflict(client, concurrent_write):
+    response = client.put('/get-people', json={"id": 1, "name": "Luke Skywalker"})
+    assert response.status_code == 409
+    people = db.session.get(People, 1)
+    assert (people.name, people.hair_color) == ('Luke 0', 'grey')
+
+def test_delete_racing_another_write_is_a_conflict(client, concurrent_write):
+    response = client.delete('/get-people', json={"id": 1})
+    assert response.status_code == 409
+    assert db.session.get(People, 1) is not None
+
+def test_put_bumps_the_etag(client):
+    add_catalog(1)
+    before = client.get('/get-people/1')
+    assert client.put('/get-people', json={"id": 1, "name": "Luke Skywalker"}).status_code == 200
+    after = client.get('/get-people/1', headers={'If-None-Match': before.headers['ETag']})
+    assert after.status_code == 200
+    assert after.json["name"] == 'Luke Skywalker'
+
+def test_favoriting_keeps_last_modified(client):
+    add_catalog(1)
+    user = add_user('fan@example.com')
+    headers = login(client, 'fan@example.com') #el login rehashea el password y eso si cambia al usuario
+    db.session.execute(People.__table__.update().values(updated_at=datetime(2020, 1, 1)))
+    db.session.execute(User.__table__.update().values(updated_at=datetime(2020, 1, 1)))
+    db.session.commit()
+    assert client.post('/add-favorite/people', json={"people_id": 1}, headers=headers).status_code == 201
+    db.session.expire_all()
+    assert db.session.get(People, 1).updated_at == datetime(2020, 1, 1)
+    assert db.session.get(User, user.id).updated_at == datetime(2020, 1, 1)
+    assert db.session.get(People, 1).favorite_count == 1
+
+def test_non_string_credentials_are_a_bad_request(client):
+    add_user('fan@example.com')
+    body = {"email": "new@example.com", "name": "new", "password": 1234, "is_active": True}
+    assert client.post('/register', json=body).status_code == 400
+    assert client.post('/login', json={"email": "fan@example.com", "password": 1234}).status_code == 400
+    assert client.post('/login', json={"email": ["fan@example.com"], "password": "secret"}).status_code == 400
+
+def test_rehash_on_login_refreshes_the_cached_user(client):
+    user = add_user('fan@example.com')
+    before = client.get('/get-user/%s' % user.id).headers['ETag']
+    login(client, 'fan@example.com') #add_user guarda el password en texto plano: el login lo rehashea
+    assert client.get('/get-user/%s' % user.id).headers['ETag'] != before
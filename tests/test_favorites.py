@@ -0,0 +1,86 @@
+from models import db, People, FavoritePeople
+from conftest import add_catalog, add_user, login
+
+def favorite_everything(client, headers, size):
+    ids = list(range(1, size + 1))
+    response = client.post('/favorites/bulk', json={"add": {"people": ids, "planet": ids, "vehicle": ids}}, headers=headers)
+    assert response.status_code == 200, response.json
+
+def count_favorites_queries(client, queries, headers):
+    #devuelve (queries del primer pedido, que arma el snapshot; queries del segundo, que lo reusa)
+    counts = []
+    for _ in range(2):
+        del queries[:]
+        response = client.post('/favorites', headers=headers)
+        assert response.status_code == 201
+        counts.append(len(queries))
+    return counts, response.json
+
+def test_favorites_queries_do_not_grow_with_favorites(client, queries):
+    add_catalog(10)
+    add_user('one@example.com')
+    add_user('many@example.com')
+    one = login(client, 'one@example.com')
+    many = login(client, 'many@example.com')
+    favorite_everything(client, one, 1)
+    favorite_everything(client, many, 10)
+
+    one_counts, one_favorites = count_favorites_queries(client, queries, one)
+    many_counts, many_favorites = count_favorites_queries(client, queries, many)
+
+    assert len(one_favorites) == 3
+    assert len(many_favorites) == 30
+    assert one_counts == many_counts
+    assert many_counts[1] <= many_counts[0]
+
+def test_favorites_follow_catalog_changes(client):
+    add_catalog(2)
+    add_user('fan@example.com')
+    headers = login(client, 'fan@example.com')
+    favorite_everything(client, headers, 1)
+    first = client.post('/favorites', headers=headers)
+
+    response = client.put('/get-people', json={"id": 1, "name": "Luke Skywalker"})
+    assert response.status_code == 200
+    again = client.post('/favorites', headers=dict(headers, **{'If-None-Match': first.headers['ETag']}))
+    assert again.status_code == 201
+    names = [favorite['people']['name'] for favorite in again.json if 'people' in favorite]
+    assert names == ['Luke Skywalker']
+
+def test_favorites_need_a_token(client):
+    assert client.post('/favorites').status_code == 401
+
+def test_deleting_a_favorited_row_removes_the_favorite(client):
+    add_catalog(2)
+    add_user('fan@example.com')
+    headers = login(client, 'fan@example.com')
+    favorite_everything(client, headers, 2)
+    first = client.post('/favorites', headers=headers)
+
+    assert client.delete('/get-people', json={"id": 1}).status_code == 200
+    again = client.post('/favorites', headers=dict(headers, **{'If-None-Match': first.headers['ETag']}))
+    assert again.status_code == 201
+    assert [favorite['people']['id'] for favorite in again.json if 'people' in favorite] == [2]
+
+def test_deleting_a_user_with_favorites_updates_the_counts(client):
+    add_catalog(1)
+    user = add_user('fan@example.com')
+    favorite_everything(client, login(client, 'fan@example.com'), 1)
+    assert People.query.get(1).favorite_count == 1
+
+    assert client.delete('/get-user', json={"id": user.id}).status_code == 200
+    db.session.expire_all()
+    assert People.query.get(1).favorite_count == 0
+    assert FavoritePeople.query.count() == 0
+
+def test_deleting_a_missing_row_is_not_found(client):
+    for path in ('/get-user', '/get-people', '/get-planet', '/get-vehicle'):
+        assert client.delete(path, json={"id": 99}).status_code == 404
+
+def test_bulk_favorites_rejects_malformed_bodies(client):
+    add_catalog(1)
+    add_user('fan@example.com')
+    headers = login(client, 'fan@example.com')
+    for body in ({"add": ["people"]}, {"add": {"people": 5}}, {"add": {"people": ["x"]}},
+            {"remove": {"planet": [True]}}, {"add": {"starship": [1]}}):
+        assert client.post('/favorites/bulk', json=body, headers=headers).status_code == 400, body
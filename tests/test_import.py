@@ -0,0 +1,42 @@
+import json
+from conftest import add_catalog, add_user, login
+
+LUKE = {"name": "Luke 0", "mass": 77, "height": 172, "hair_color": "grey", "skin_color": "fair",
+    "eye_color": "blue", "birth_year": "19BBY", "gender": "male"}
+HAN = dict(LUKE, name="Han Solo", hair_color="brown")
+
+def import_people(client, *rows):
+    body = ''.join(json.dumps(row) + '\n' for row in rows)
+    response = client.post('/import/people', data=body, content_type='application/x-ndjson')
+    assert response.status_code == 200, response.json
+    return response.json
+
+def test_import_refreshes_favorites(client):
+    add_catalog(1)
+    add_user('fan@example.com')
+    headers = login(client, 'fan@example.com')
+    client.post('/add-favorite/people', json={"people_id": 1}, headers=headers)
+    before = client.post('/favorites', headers=headers)
+
+    import_people(client, LUKE)
+    after = client.post('/favorites', headers=dict(headers, **{'If-None-Match': before.headers['ETag']}))
+    assert after.headers['ETag'] != before.headers['ETag']
+    assert after.json[0]['people']['hair_color'] == 'grey'
+
+def test_import_writes_the_change_feed(client):
+    add_catalog(1)
+    add_user('reader@example.com')
+    headers = login(client, 'reader@example.com')
+    assert import_people(client, LUKE, HAN)["imported"] == 2
+
+    changes = client.get('/changes?entity=people', headers=headers).json["results"]
+    actions = {change["data"]["name"]: (change["action"], change["entity_id"]) for change in changes}
+    assert actions == {"Luke 0": ("updated", 1), "Han Solo": ("created", 2)}
+
+def test_bad_lines_are_reported_and_the_rest_imported(client):
+    body = '\n'.join([json.dumps(LUKE), '{"name": ', '[1, 2]', json.dumps(dict(HAN, name='x' * 51)), json.dumps(HAN)]) + '\n'
+    response = client.post('/import/people', data=body, content_type='application/x-ndjson')
+    assert response.status_code == 200, response.json
+    assert (response.json["received"], response.json["imported"], response.json["invalid"]) == (5, 2, 3)
+    assert [error["line"] for error in response.json["errors"]] == [2, 3, 4]
+    assert client.get('/search?q=han').json["total"] == 1
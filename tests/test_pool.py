@@ -0,0 +1,38 @@
+from sqlalchemy import create_engine, text
+from pool import InstrumentedQueuePool, engine_options_from_env, pool_stats
+
+def test_engine_options_from_env(monkeypatch):
+    monkeypatch.setenv('DB_POOL_SIZE', '3')
+    monkeypatch.setenv('DB_MAX_OVERFLOW', '4')
+    monkeypatch.setenv('DB_POOL_PRE_PING', '0')
+    monkeypatch.setenv('DB_STATEMENT_TIMEOUT_MS', '5000')
+    assert engine_options_from_env('sqlite://') == {}
+    assert engine_options_from_env('sqlite:///:memory:') == {}
+
+    options = engine_options_from_env('sqlite:////tmp/example.db')
+    assert options["poolclass"] is InstrumentedQueuePool
+    assert (options["pool_size"], options["max_overflow"], options["pool_pre_ping"]) == (3, 4, False)
+    assert options["connect_args"] == {"check_same_thread": False}
+
+    options = engine_options_from_env('postgresql://localhost/example')
+    assert options["connect_args"] == {"options": "-c statement_timeout=5000"}
+
+def test_instrumented_pool_counts_checkouts_and_invalidations(tmp_path, monkeypatch):
+    monkeypatch.delenv('DB_STATEMENT_TIMEOUT_MS', raising=False)
+    url = 'sqlite:///%s' % (tmp_path / 'pool.db')
+    engine = create_engine(url, **engine_options_from_env(url))
+    with engine.connect() as connection:
+        connection.execute(text('SELECT 1'))
+        assert pool_stats(engine)["checked_out"] == 1
+    with engine.connect() as connection:
+        connection.invalidate()
+    stats = pool_stats(engine)
+    assert stats["checked_out"] == 0
+    assert stats["checkouts"] == 2
+    assert stats["invalidations"] == 1
+    assert stats["connects"] == 1
+    engine.dispose()
+
+def test_pool_stats_of_other_pools():
+    engine = create_engine('sqlite://')
+    assert pool_stats(engine)["pool"] == type(engine.pool).__name__
@@ -0,0 +1,88 @@
+import pytest
+from ratelimit import MemoryBucketStore, RedisBucketStore, RateLimiter, TAKE_SCRIPT, parse_budget
+from utils import APIException
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+class FakeEvalRedis:
+    #corre TAKE_SCRIPT "a mano" en python, con las mismas respuestas que manda redis (bytes)
+    def __init__(self):
+        self.hashes = {}
+        self.calls = []
+
+    def eval(self, script, numkeys, key, rate, burst, now, cost):
+        assert script == TAKE_SCRIPT and numkeys == 1
+        self.calls.append(key)
+        tokens, last = self.hashes.get(key, (burst, now))
+        tokens = min(burst, tokens + max(0, now - last) * rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        self.hashes[key] = (tokens, now)
+        if allowed:
+            return [1, b'0']
+        return [0, str((cost - tokens) / rate).encode()]
+
+def test_memory_bucket_allows_burst_then_refills():
+    clock = Clock()
+    store = MemoryBucketStore(clock=clock)
+    assert store.take('login:ip:1', rate=1, burst=2) == (True, 0)
+    assert store.take('login:ip:1', rate=1, burst=2) == (True, 0)
+    assert store.take('login:ip:1', rate=1, burst=2) == (False, 1.0)
+    clock.now += 0.5
+    allowed, retry_after = store.take('login:ip:1', rate=1, burst=2)
+    assert not allowed and retry_after == pytest.approx(0.5)
+    clock.now += 0.5
+    assert store.take('login:ip:1', rate=1, burst=2) == (True, 0)
+
+def test_memory_bucket_keys_are_independent_and_bounded():
+    clock = Clock()
+    store = MemoryBucketStore(max_keys=2, clock=clock)
+    assert store.take('a', rate=1, burst=1)[0]
+    assert not store.take('a', rate=1, burst=1)[0]
+    assert store.take('b', rate=1, burst=1)[0]
+    store.take('c', rate=1, burst=1) #se descarta 'a', el mas viejo: vuelve con el bucket lleno
+    assert store.take('a', rate=1, burst=1)[0]
+
+def test_redis_bucket_store_uses_prefix_and_parses_replies():
+    clock = Clock()
+    client = FakeEvalRedis()
+    store = RedisBucketStore(client, prefix='test:', clock=clock)
+    assert store.take('search:user:1', rate=2, burst=1) == (True, 0.0)
+    assert store.take('search:user:1', rate=2, burst=1) == (False, 0.5)
+    clock.now += 0.5
+    assert store.take('search:user:1', rate=2, burst=1) == (True, 0.0)
+    assert client.calls == ['test:search:user:1'] * 3
+
+def test_rate_limiter_answers_429_with_retry_after():
+    limiter = RateLimiter(MemoryBucketStore(clock=Clock()), default_budget=(1, 1), budgets={'login': (0.25, 1)})
+    limiter.check('handle_hello', 'ip:1')
+    limiter.check('login', 'ip:1')
+    with pytest.raises(APIException) as error:
+        limiter.check('login', 'ip:1')
+    assert error.value.status_code == 429
+    assert error.value.headers == {'Retry-After': '4'}
+    limiter.check('login', 'ip:2') #otro cliente tiene su propio presupuesto
+
+def test_rate_limiter_sheds_past_max_concurrent(app):
+    limiter = RateLimiter(MemoryBucketStore(), max_concurrent=1)
+    with app.test_request_context():
+        limiter.admit('handle_hello')
+        with app.test_request_context():
+            with pytest.raises(APIException) as error:
+                limiter.admit('handle_hello')
+            assert error.value.status_code == 503
+        assert limiter.in_flight == 1
+        limiter.release()
+    assert limiter.in_flight == 0
+    with app.test_request_context():
+        limiter.admit('handle_hello')
+        limiter.release()
+
+def test_parse_budget():
+    assert parse_budget('5:20') == (5.0, 20.0)
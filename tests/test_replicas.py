@@ -0,0 +1,69 @@
+import pytest
+from sqlalchemy import event
+from app import entity_cache
+from models import db, People
+from replicas import router
+from conftest import REPLICA_KEYS, add_catalog
+
+@pytest.fixture
+def replica(app):
+    #la replica es otro archivo sqlite con el mismo esquema y datos distintos, para ver de donde se leyo
+    engine = db.engines[REPLICA_KEYS[0]]
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(People.__table__.insert().values(id=1, name='Replica Luke', mass=1, height=1,
+            hair_color='a', skin_color='a', eye_color='a', birth_year='a', gender='a'))
+    router.keys = list(REPLICA_KEYS)
+    router._ejected_until.clear()
+    add_catalog(1)
+    return engine
+
+def test_reads_go_to_the_replica(client, replica):
+    assert client.get('/get-people/1').json["name"] == 'Replica Luke'
+
+def test_writes_go_to_the_primary(client, replica):
+    response = client.put('/get-people', json={"id": 1, "name": "Luke Skywalker"})
+    assert response.status_code == 200
+    assert db.session.get(People, 1).name == 'Luke Skywalker'
+    with replica.connect() as connection:
+        assert connection.execute(People.__table__.select()).one().name == 'Replica Luke'
+
+@pytest.fixture
+def disconnects(replica):
+    #cualquier error de la replica se trata como conexion perdida
+    def as_disconnect(context):
+        context.is_disconnect = True
+    event.listen(replica, 'handle_error', as_disconnect)
+    yield
+    event.remove(replica, 'handle_error', as_disconnect)
+
+def test_failing_replica_is_ejected_and_read_retried_on_primary(client, replica, disconnects):
+    People.__table__.drop(replica)
+    response = client.get('/get-people/1')
+    assert response.status_code == 200
+    assert response.json["name"] == 'Luke 0'
+    assert router.stats()[REPLICA_KEYS[0]] == {"healthy": False}
+
+def test_query_errors_do_not_eject_the_replica(client, replica):
+    People.__table__.drop(replica)
+    assert client.get('/get-people/1').status_code == 500
+    assert router.stats()[REPLICA_KEYS[0]] == {"healthy": True}
+
+def test_replica_reads_do_not_refill_a_fresh_invalidation(client, replica):
+    assert client.put('/get-people', json={"id": 1, "name": "Luke Skywalker"}).status_code == 200
+    assert client.get('/get-people/1').json["name"] == 'Replica Luke'
+    assert "data" not in entity_cache.get('people:1')
+
+def test_round_robin_skips_ejected():
+    saved = (router.keys, dict(router._ejected_until))
+    router.keys = ['replica_0', 'replica_1']
+    router._ejected_until.clear()
+    try:
+        assert {router.choose(), router.choose()} == {'replica_0', 'replica_1'}
+        router.eject('replica_0')
+        assert [router.choose(), router.choose()] == ['replica_1', 'replica_1']
+        router.eject('replica_1')
+        assert router.choose() is None
+    finally:
+        router.keys, router._ejected_until = saved[0], saved[1]
@@ -0,0 +1,34 @@
+import time
+from search import SearchIndex
+
+def planets_index(size, max_postings):
+    #indice armado a mano, sin base: climate "arid" esta en todas las filas
+    index = SearchIndex(check_seconds=3600, max_postings=max_postings)
+    for id in range(1, size + 1):
+        index._add('planet', id, {"name": "Planet %s" % id, "climate": "arid", "terrain": "desert"}, index._postings, index._docs)
+    index._vocabulary = sorted(index._postings)
+    index._checked_at = time.monotonic()
+    index._ready.set()
+    return index
+
+def test_common_word_is_scored_on_a_sample():
+    index = planets_index(1000, max_postings=100)
+    total, results = index.search('arid', limit=5)
+    assert total == 1000
+    assert len(results) == 5
+    assert [result["score"] for result in results] == [3] * 5 #exacta (x3) en climate (peso 1)
+
+def test_rare_word_is_exact_and_ranked():
+    index = planets_index(1000, max_postings=100)
+    total, results = index.search('planet 12')
+    assert [result["id"] for result in results[:2]] == [12, 120]
+    assert total == 11 #12 y 120..129
+    assert results[0]["score"] > results[1]["score"]
+
+def test_kinds_filter_and_removed_rows():
+    index = planets_index(10, max_postings=100)
+    assert index.search('arid', kinds=['people']) == (0, [])
+    index._replace('planet', 3, None)
+    total, results = index.search('planet 3')
+    assert (total, results) == (0, [])
+    assert index.search('arid')[0] == 9